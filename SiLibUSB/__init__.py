@@ -1,2 +1,7 @@
 from .siusbdevice import SiUSBDevice, GetUSBBoards, GetUSBDevices, __version__, __version_info__
-__all__ = ['SiUSBDevice', 'GetUSBBoards', 'GetUSBDevices', '__version__', '__version_info__']
+from .readout import FastBlockReader, MultiBoardReader, Chunk, FastBlockRecorder
+from .multidevice import SiUSBDevicePool, BoardResult
+from .registercache import RegisterCache
+from .emulator import EmulatedDevice
+from .asyncdevice import AsyncSiUSBDevice
+__all__ = ['SiUSBDevice', 'GetUSBBoards', 'GetUSBDevices', 'FastBlockReader', 'MultiBoardReader', 'Chunk', 'FastBlockRecorder', 'SiUSBDevicePool', 'BoardResult', 'RegisterCache', 'EmulatedDevice', 'AsyncSiUSBDevice', '__version__', '__version_info__']
@@ -0,0 +1,125 @@
+r"""asyncio interface for SILAB USB devices.
+
+PyUSB transfers are blocking, so each AsyncSiUSBDevice runs the transfers of its
+device on a dedicated worker thread. Requests are executed in submission order,
+which serializes the access to the device without blocking the event loop, and
+transfers to different devices run concurrently. Cancelling a request which did not
+start yet removes it from the queue; a running USB transfer completes in the worker.
+
+Each awaited call costs one hand-over to the worker thread. Use run() to execute a
+sequence of accesses with a single hand-over.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .siusbdevice import SiUSBDevice
+
+
+class AsyncSiUSBDevice(object):
+    '''Awaitable wrapper of a SiUSBDevice.
+
+    Example:
+        dev = AsyncSiUSBDevice(SiUSBDevice.from_board_id(123))
+        await dev.WriteExternal(0x0000, [0xa0])
+        data = await dev.ReadExternal(0x0000, 16)
+        data = await dev.run(lambda d: [d.ReadExternal(addr, 1) for addr in range(16)])
+    '''
+
+    def __init__(self, device=None, **kwargs):
+        if device is None or not isinstance(device, SiUSBDevice):
+            device = SiUSBDevice(device=device, **kwargs)
+        self.device = device
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncSiUSBDevice')
+
+    @classmethod
+    async def open(cls, device=None, **kwargs):
+        '''Open the device without blocking the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncSiUSBDevice')
+        try:
+            sync_device = await loop.run_in_executor(executor, functools.partial(SiUSBDevice, device=device, **kwargs))
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+        self = cls.__new__(cls)
+        self.device = sync_device
+        self._executor = executor
+        return self
+
+    @classmethod
+    async def from_board_id(cls, board_id):
+        loop = asyncio.get_running_loop()
+        device = await loop.run_in_executor(None, SiUSBDevice.from_board_id, board_id)
+        return cls(device)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.device)
+
+    def _submit(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run(self, func, *args, **kwargs):
+        '''Call func(device, *args, **kwargs) in the worker thread and return its result.
+        '''
+        return await self._submit(func, self.device, *args, **kwargs)
+
+    async def WriteExternal(self, address, data):
+        return await self._submit(self.device.WriteExternal, address, data)
+
+    async def ReadExternal(self, address, size, dtype=None, byteorder=None):
+        return await self._submit(self.device.ReadExternal, address, size, dtype, byteorder)
+
+    async def ReadExternalInto(self, address, buf):
+        return await self._submit(self.device.ReadExternalInto, address, buf)
+
+    async def ReadExternalMulti(self, ranges, max_gap=16):
+        return await self._submit(self.device.ReadExternalMulti, ranges, max_gap)
+
+    async def FastBlockWrite(self, data, transfer_size=None, dtype=None, byteorder=None):
+        return await self._submit(self.device.FastBlockWrite, data, transfer_size, dtype, byteorder)
+
+    async def FastBlockRead(self, size, transfer_size=None, dtype=None, byteorder=None):
+        return await self._submit(self.device.FastBlockRead, size, transfer_size, dtype, byteorder)
+
+    async def FastBlockReadInto(self, buf, transfer_size=None):
+        return await self._submit(self.device.FastBlockReadInto, buf, transfer_size)
+
+    async def WriteI2C(self, address, data):
+        return await self._submit(self.device.WriteI2C, address, data)
+
+    async def ReadI2C(self, address, size):
+        return await self._submit(self.device.ReadI2C, address, size)
+
+    async def DownloadXilinx(self, filename, **kwargs):
+        return await self._submit(self.device.DownloadXilinx, filename, **kwargs)
+
+    async def EnsureXilinxLoaded(self, filename, **kwargs):
+        return await self._submit(self.device.EnsureXilinxLoaded, filename, **kwargs)
+
+    async def XilinxAlreadyLoaded(self):
+        return await self._submit(self.device.XilinxAlreadyLoaded)
+
+    async def GetBoardId(self):
+        return await self._submit(self.device.GetBoardId)
+
+    async def GetName(self):
+        return await self._submit(self.device.GetName)
+
+    async def GetFWVersion(self):
+        return await self._submit(self.device.GetFWVersion)
+
+    async def dispose(self):
+        '''Wait for pending requests, release the device and stop the worker thread.
+        '''
+        await self._submit(self.device.dispose)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.dispose()
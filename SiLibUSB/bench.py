@@ -0,0 +1,226 @@
+r"""Benchmarks for SILAB USB devices.
+
+Run with:
+    python -m SiLibUSB.bench [--emulate] [--output results.json] [--baseline baseline.json]
+
+Measures fast block read/write over a matrix of sizes, single register latency,
+batched register access and bitstream parsing/download. Each benchmark reports
+percentiles of the run time. Results are written as JSON and can be compared to a
+baseline; the exit code is 1 if a benchmark is slower than the baseline by more than
+the given threshold.
+
+The register and batch benchmarks write to 64 bytes of the external bus. On hardware
+they only run with --address giving a range the FPGA firmware does not use.
+"""
+
+import argparse
+import json
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+
+from . import siusbdevice
+from .siusbdevice import SiUSBDevice, __version__
+
+
+DEFAULT_SIZES = [2 ** 10, 2 ** 14, 2 ** 16, 2 ** 18, 2 ** 20, 2 ** 21, 2 ** 22]
+
+
+def percentiles(samples):
+    '''Return statistics of a list of run times in seconds.
+    '''
+    samples = sorted(samples)
+    n = len(samples)
+
+    def percentile(p):
+        return samples[min(n - 1, int(round(p / 100.0 * (n - 1))))]
+
+    return {
+        'n': n,
+        'min': samples[0],
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': samples[-1],
+        'mean': sum(samples) / n
+    }
+
+
+def measure(func, repeat, warmup=1):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def _throughput(result, size):
+    result['size'] = size
+    result['MB/s'] = size / result['p50'] / 2 ** 20 if result['p50'] > 0.0 else float('inf')
+    return result
+
+
+def bench_block(dev, sizes, repeat):
+    results = {}
+    for size in sizes:
+        buf = bytearray(size)
+        results['block_read/%d' % size] = _throughput(measure(lambda: dev.FastBlockRead(size), repeat), size)
+        results['block_read_into/%d' % size] = _throughput(measure(lambda: dev.FastBlockReadInto(buf), repeat), size)
+        results['block_write/%d' % size] = _throughput(measure(lambda: dev.FastBlockWrite(buf), repeat), size)
+    return results
+
+
+def bench_register(dev, repeat, address):
+    return {
+        'register_read': measure(lambda: dev.ReadExternal(address, 1), repeat),
+        'register_write': measure(lambda: dev.WriteExternal(address, [0]), repeat)
+    }
+
+
+def bench_batch(dev, repeat, address, count=64):
+    def single():
+        for i in range(count):
+            dev.WriteExternal(address + i, [i & 0xff])
+
+    def batch():
+        with dev.batch() as b:
+            for i in range(count):
+                b.write(address + i, [i & 0xff])
+
+    return {
+        'register_write_single/%d' % count: measure(single, repeat),
+        'register_write_batch/%d' % count: measure(batch, repeat)
+    }
+
+
+def write_bit_file(filename, size):
+    '''Write a synthetic Xilinx .bit file with a random bitstream of the given size.
+    '''
+    def section(letter, value):
+        return letter + struct.pack('>H', len(value)) + value
+
+    with open(filename, 'wb') as f:
+        f.write(bytes(bytearray([0, 9, 15, 240, 15, 240, 15, 240, 15, 240, 0, 0, 1])))
+        f.write(section(b'a', b'bench.ncd\0') + section(b'b', b'bench\0') + section(b'c', b'2000/01/01\0') + section(b'd', b'00:00:00\0'))
+        f.write(b'e' + struct.pack('>I', size) + os.urandom(size))
+
+
+def bench_bitstream(dev, filename, repeat, download=False):
+    def parse():
+        siusbdevice._bit_file_cache.clear()
+        dev._read_bit_file(filename)
+
+    results = {
+        'bitstream_parse': measure(parse, repeat),
+        'bitstream_parse_cached': measure(lambda: dev._read_bit_file(filename), repeat)
+    }
+    if download:
+        results['bitstream_download'] = measure(lambda: dev.DownloadXilinx(filename, poll=True), repeat, warmup=0)
+    return results
+
+
+def compare(results, baseline, threshold, key='p50'):
+    '''Return list of (name, baseline, result) for benchmarks which are slower than the baseline.
+    '''
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None or key not in reference:
+            continue
+        if result[key] > reference[key] * (1.0 + threshold):
+            regressions.append((name, reference[key], result[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m SiLibUSB.bench', description='Benchmark SILAB USB devices')
+    parser.add_argument('--emulate', action='store_true', help='use an emulated device instead of hardware')
+    parser.add_argument('--bandwidth', type=float, default=None, help='emulated link bandwidth in bytes/s')
+    parser.add_argument('--latency', type=float, default=0.0, help='emulated latency per transfer in s')
+    parser.add_argument('--board-id', default=None, help='board ID of the device, by default the first device is used')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='block sizes in bytes')
+    parser.add_argument('--repeat', type=int, default=20, help='number of samples per benchmark')
+    parser.add_argument('--only', nargs='+', choices=['block', 'register', 'batch', 'bitstream'], default=['block', 'register', 'batch', 'bitstream'])
+    parser.add_argument('--bit-file', default=None, help='bitstream file, by default a synthetic file is generated')
+    parser.add_argument('--bit-size', type=int, default=2 ** 21, help='bitstream size of the synthetic file in bytes')
+    parser.add_argument('--address', type=lambda value: int(value, 0), default=None, help='external bus address of 64 unused bytes for the register and batch benchmarks (overwritten, required unless emulated)')
+    parser.add_argument('--download', action='store_true', help='also benchmark DownloadXilinx (reprograms the FPGA, requires --bit-file unless emulated)')
+    parser.add_argument('--output', default=None, help='write results to JSON file')
+    parser.add_argument('--baseline', default=None, help='compare results to JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown compared to the baseline')
+    args = parser.parse_args(argv)
+    if args.download and 'bitstream' in args.only and args.bit_file is None and not args.emulate:
+        parser.error('--download requires --bit-file (or --emulate), a synthetic bitstream would reprogram the FPGA with random data')
+    address = args.address
+    if address is None and args.emulate:
+        address = 0x0000
+    if address is None and ('register' in args.only or 'batch' in args.only):
+        print('Skipping register and batch benchmarks, they overwrite the external bus: select unused addresses with --address')
+
+    if args.emulate:
+        from .emulator import EmulatedDevice
+        dev = SiUSBDevice(device=EmulatedDevice(bandwidth=args.bandwidth, latency=args.latency))
+    elif args.board_id is not None:
+        dev = SiUSBDevice.from_board_id(args.board_id)
+    else:
+        dev = SiUSBDevice()
+
+    results = {}
+    tmp_file = None
+    try:
+        if 'block' in args.only:
+            results.update(bench_block(dev, args.sizes, args.repeat))
+        if 'register' in args.only and address is not None:
+            results.update(bench_register(dev, args.repeat * 10, address))
+        if 'batch' in args.only and address is not None:
+            results.update(bench_batch(dev, args.repeat, address))
+        if 'bitstream' in args.only:
+            filename = args.bit_file
+            if filename is None:
+                fd, tmp_file = tempfile.mkstemp(suffix='.bit')
+                os.close(fd)
+                filename = tmp_file
+                write_bit_file(filename, args.bit_size)
+            results.update(bench_bitstream(dev, filename, args.repeat, download=args.download))
+    finally:
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        dev.dispose()
+
+    for name, result in sorted(results.items()):
+        line = '%-36s p50 %10.3f ms  p90 %10.3f ms  p99 %10.3f ms' % (name, result['p50'] * 1e3, result['p90'] * 1e3, result['p99'] * 1e3)
+        if 'MB/s' in result:
+            line += '  %8.2f MB/s' % result['MB/s']
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'host': platform.node(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'emulated': args.emulate,
+                'time': time.time(),
+                'results': results
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, reference, result in regressions:
+            print('REGRESSION %s: p50 %.3f ms (baseline %.3f ms, %+.1f%%)' % (name, result * 1e3, reference * 1e3, (result / reference - 1.0) * 100.0))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+r"""Device broker sharing SILAB USB devices between local processes.
+
+The broker owns the USB device handles. Clients connect through a Unix socket and
+use SiUSBDeviceProxy (from SiLibUSB.broker import SiUSBDeviceProxy), which offers
+the SiUSBDevice API. Register accesses and other calls are forwarded through the
+socket. Bulk data of the fast block interface is
+exchanged through a shared memory ring buffer of each client, only the offset and
+the size are sent through the socket.
+
+Messages are JSON encoded (byte buffers as base64), nothing received is unpickled.
+The socket is only accessible by the user running the broker.
+
+Start the broker with:
+    python -m SiLibUSB.broker --socket /tmp/silibusb.sock
+"""
+
+import argparse
+import array
+import base64
+import errno
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import usb.core
+
+from .siusbdevice import SiUSBDevice, GetUSBBoards, TransferError, TransferTimeoutError, _typed_buffer, _typed_result, _typed_data, np
+
+
+DEFAULT_SOCKET = '/tmp/silibusb.sock'
+DEFAULT_SHM_SIZE = 2 ** 23
+
+# methods of SiUSBDevice which clients can call
+ALLOWED_METHODS = frozenset([
+    'WriteExternal', 'ReadExternal', 'ReadExternalMulti', 'WriteEEPROM', 'ReadEEPROM', 'WriteI2C', 'ReadI2C',
+    'GetFWVersion', 'GetName', 'SetName', 'GetBoardId', 'SetBoardId', 'DownloadXilinx', 'EnsureXilinxLoaded', 'XilinxAlreadyLoaded',
+    'GetXilinxConfByte', 'GetXilinxConfPin', 'SetXilinxConfPin', 'WaitXilinxConfPin', 'TuneTransferSize',
+    'invalidate_identity'
+])
+ALLOWED_PROPERTIES = frozenset(['board_id', 'board_name', 'fw_version'])
+
+_LENGTH = struct.Struct('>I')
+MAX_MESSAGE_SIZE = 2 ** 26
+
+# exceptions re-raised in the client by type name, other exceptions are raised as RuntimeError
+_ERRORS = dict((cls.__name__, cls) for cls in (
+    ValueError, TypeError, AttributeError, KeyError, IndexError, NotImplementedError, IOError, OSError, RuntimeError,
+    usb.core.USBError, TransferError, TransferTimeoutError
+))
+if hasattr(usb.core, 'USBTimeoutError'):
+    _ERRORS['USBTimeoutError'] = usb.core.USBTimeoutError
+
+# names of the shared memory segments created by clients in this process
+_client_segments = set()
+
+
+def _encode(obj):
+    # convert to JSON compatible objects, buffers are base64 encoded
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [_encode(item) for item in obj]
+    if isinstance(obj, dict):
+        return dict((str(key), _encode(value)) for key, value in obj.items())
+    if isinstance(obj, array.array):
+        return {'__array__': obj.typecode, 'data': base64.b64encode(obj.tobytes()).decode('ascii')}
+    if np is not None and isinstance(obj, np.ndarray):
+        return {'__ndarray__': obj.dtype.str, 'data': base64.b64encode(np.ascontiguousarray(obj).tobytes()).decode('ascii')}
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(obj)).decode('ascii')}
+    raise TypeError('Cannot encode object of type %s' % type(obj).__name__)
+
+
+def _decode(obj):
+    if isinstance(obj, list):
+        return [_decode(item) for item in obj]
+    if isinstance(obj, dict):
+        if '__bytes__' in obj:
+            return base64.b64decode(obj['__bytes__'])
+        if '__array__' in obj:
+            ret = array.array(str(obj['__array__']))
+            ret.frombytes(base64.b64decode(obj['data']))
+            return ret
+        if '__ndarray__' in obj:
+            if np is None:
+                raise TypeError('NumPy required to decode array')
+            return np.frombuffer(bytearray(base64.b64decode(obj['data'])), dtype=obj['__ndarray__'])
+        return dict((key, _decode(value)) for key, value in obj.items())
+    return obj
+
+
+def _encode_error(e):
+    message = e.strerror if isinstance(e, usb.core.USBError) and e.strerror is not None else str(e)
+    return {'type': type(e).__name__, 'message': message, 'errno': getattr(e, 'errno', None), 'transferred': getattr(e, 'transferred', None)}
+
+
+def _decode_error(error):
+    cls = _ERRORS.get(error.get('type'))
+    message = error.get('message', '')
+    if cls is None:
+        return RuntimeError('%s: %s' % (error.get('type'), message))
+    if issubclass(cls, TransferError):
+        e = cls(message, error.get('transferred') or 0)
+        e.errno = error.get('errno')
+        return e
+    if issubclass(cls, usb.core.USBError):
+        return cls(message, None, error.get('errno'))
+    return cls(message)
+
+
+def _send(sock, obj):
+    data = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise EOFError('Connection closed')
+        received += n
+    return buf
+
+
+def _recv(sock):
+    size = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))[0]
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError('Message too large')
+    return json.loads(_recv_exactly(sock, size).decode('utf-8'))
+
+
+def _attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    if name in _client_segments:  # broker and client in the same process
+        return shm
+    try:
+        # the client owns the segment, do not let the resource tracker of the broker remove it
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class DeviceBroker(object):
+    '''Serve SiUSBDevice objects to local clients through a Unix socket.
+    '''
+
+    def __init__(self, devices, socket_path=DEFAULT_SOCKET):
+        self.devices = dict((device.board_id, device) for device in devices)
+        self.socket_path = socket_path
+        self._sock = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _find_device(self, board_id):
+        if board_id is None:
+            if len(self.devices) != 1:
+                raise ValueError('Board ID required, %d devices available' % len(self.devices))
+            return list(self.devices.values())[0]
+        for curr_board_id, device in self.devices.items():
+            if curr_board_id == board_id or "".join(filter(str.isdigit, curr_board_id)) == str(board_id):
+                return device
+        raise ValueError('No device found with board ID %s' % str(board_id))
+
+    def _remove_stale_socket(self):
+        # remove the socket file of a broker which is not running anymore
+        try:
+            mode = os.stat(self.socket_path).st_mode
+        except OSError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError('%s exists and is not a socket' % self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error as e:
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                raise
+        else:
+            raise RuntimeError('Broker already running on %s' % self.socket_path)
+        finally:
+            sock.close()
+        os.remove(self.socket_path)
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)  # socket only accessible by the owner (0o600)
+        try:
+            self._sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        self._sock.listen(16)
+        self._sock.settimeout(0.2)
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = self._sock.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                thread = threading.Thread(target=self._serve_client, args=(conn,), name='DeviceBroker-client')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._sock.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def start(self):
+        '''Run the broker in a background thread.
+        '''
+        thread = threading.Thread(target=self.serve_forever, name='DeviceBroker')
+        thread.daemon = True
+        thread.start()
+        self._server_thread = thread
+
+    def shutdown(self):
+        self._stop.set()
+        thread = getattr(self, '_server_thread', None)
+        if thread is not None:
+            thread.join()
+
+    def _serve_client(self, conn):
+        shm = None
+        try:
+            while True:
+                try:
+                    op, board_id, args, kwargs = _recv(conn)
+                    args = _decode(args)
+                    kwargs = _decode(kwargs)
+                except EOFError:
+                    break
+                except (ValueError, TypeError, socket.error):  # malformed message or broken connection
+                    break
+                view = None
+                try:
+                    if op == 'list':
+                        result = sorted(self.devices.keys())
+                    elif op == 'attach_shm':
+                        if shm is not None:
+                            shm.close()
+                        shm = _attach_shared_memory(args[0])
+                        result = None
+                    else:
+                        device = self._find_device(board_id)
+                        if op in ('FastBlockReadShm', 'FastBlockWriteShm'):
+                            offset, size, transfer_size = args
+                            if shm is None or offset < 0 or size < 0 or offset + size > shm.size:
+                                raise ValueError('Invalid shared memory range')
+                            view = shm.buf[offset:offset + size]
+                            if op == 'FastBlockReadShm':
+                                result = device.FastBlockReadInto(view, transfer_size)
+                            else:
+                                device.FastBlockWrite(view, transfer_size)
+                                result = None
+                        elif op == 'getattr' and args[0] in ALLOWED_PROPERTIES:
+                            result = getattr(device, args[0])
+                        elif op in ALLOWED_METHODS:
+                            result = getattr(device, op)(*args, **kwargs)
+                        else:
+                            raise AttributeError('Operation %s not allowed' % op)
+                    response = [True, _encode(result)]
+                except Exception as e:
+                    # errors are sent as type and message, they may hold views of the shared memory
+                    response = [False, _encode_error(e)]
+                finally:
+                    if view is not None:
+                        view.release()
+                try:
+                    _send(conn, response)
+                except socket.error:
+                    break
+        finally:
+            if shm is not None:
+                try:
+                    shm.close()
+                except BufferError:  # a view is still referenced, released with the segment
+                    pass
+            conn.close()
+
+
+class SiUSBDeviceProxy(object):
+    '''Client of a DeviceBroker offering the SiUSBDevice API.
+
+    Fast block data is exchanged through a shared memory ring buffer of shm_size bytes.
+    Views returned by FastBlockReadView() stay valid until shm_size more bytes have
+    been transferred, dispose() releases them.
+    '''
+
+    def __init__(self, board_id=None, socket_path=DEFAULT_SOCKET, shm_size=DEFAULT_SHM_SIZE):
+        self._board_id = board_id
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._lock = threading.Lock()
+        self._shm_lock = threading.Lock()  # held while a transfer uses the ring buffer
+        self._shm = shared_memory.SharedMemory(create=True, size=shm_size)
+        self._shm_offset = 0
+        self._views = {}  # weak references to the views returned by FastBlockReadView()
+        _client_segments.add(self._shm.name)
+        self._request('attach_shm', self._shm.name)
+
+    @classmethod
+    def list_boards(cls, socket_path=DEFAULT_SOCKET):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        try:
+            _send(sock, ['list', None, [], {}])
+            success, result = _recv(sock)
+        finally:
+            sock.close()
+        return result
+
+    def _request(self, op, *args, **kwargs):
+        with self._lock:
+            _send(self._sock, [op, self._board_id, _encode(args), _encode(kwargs)])
+            success, result = _recv(self._sock)
+        if not success:
+            raise _decode_error(result)
+        return _decode(result)
+
+    def __getattr__(self, name):
+        if name in ALLOWED_METHODS:
+            def method(*args, **kwargs):
+                return self._request(name, *args, **kwargs)
+            method.__name__ = name
+            return method
+        if name in ALLOWED_PROPERTIES:
+            return self._request('getattr', name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return '%s' % "".join(filter(str.isdigit, self.board_id))
+
+    def _shm_chunks(self, size):
+        # yields (offset in shared memory, offset in data, size) wrapping around the ring buffer,
+        # the caller holds _shm_lock for the whole transfer
+        shm_size = self._shm.size
+        done = 0
+        while done < size:
+            if self._shm_offset == shm_size:
+                self._shm_offset = 0
+            chunk = min(size - done, shm_size - self._shm_offset)
+            yield self._shm_offset, done, chunk
+            self._shm_offset += chunk
+            done += chunk
+
+    def FastBlockReadView(self, size, transfer_size=None):
+        '''Read up to the shared memory size and return a view into the shared memory.
+        '''
+        if size > self._shm.size:
+            raise ValueError('Size larger than shared memory')
+        with self._shm_lock:
+            if self._shm_offset + size > self._shm.size:
+                self._shm_offset = 0
+            offset = self._shm_offset
+            self._shm_offset += size
+        read = self._request('FastBlockReadShm', offset, size, transfer_size)
+        view = self._shm.buf[offset:offset + read]
+        views = self._views
+        key = id(view)
+        views[key] = weakref.ref(view, lambda ref, key=key: views.pop(key, None))
+        return view
+
+    def FastBlockReadInto(self, buf, transfer_size=None):
+        view = memoryview(buf).cast('B')
+        read = 0
+        with self._shm_lock:
+            for shm_offset, offset, size in self._shm_chunks(len(view)):
+                try:
+                    n = self._request('FastBlockReadShm', shm_offset, size, transfer_size)
+                except TransferError as e:
+                    # data received before the error is in the shared memory
+                    view[read:read + e.transferred] = self._shm.buf[shm_offset:shm_offset + e.transferred]
+                    e.transferred += read
+                    e.buffer = buf
+                    raise
+                view[read:read + n] = self._shm.buf[shm_offset:shm_offset + n]
+                read += n
+                if n < size:
+                    break
+        return read
+
+    def FastBlockRead(self, size, transfer_size=None, dtype=None, byteorder=None):
+        if dtype is not None:
+            buf = _typed_buffer(size, dtype, byteorder)
+            return _typed_result(buf, self.FastBlockReadInto(buf, transfer_size), byteorder)
+        ret = array.array('B', bytes(size))
+        read = self.FastBlockReadInto(ret, transfer_size)
+        del ret[read:]
+        return ret
+
+    def FastBlockWrite(self, data, transfer_size=None, dtype=None, byteorder=None):
+        if dtype is not None:
+            data = _typed_data(data, dtype, byteorder)
+        if isinstance(data, (list, tuple, str)):
+            data = bytearray(data.encode('utf-8') if isinstance(data, str) else data)
+        view = memoryview(data).cast('B')
+        with self._shm_lock:
+            for shm_offset, offset, size in self._shm_chunks(len(view)):
+                self._shm.buf[shm_offset:shm_offset + size] = view[offset:offset + size]
+                self._request('FastBlockWriteShm', shm_offset, size, transfer_size)
+
+    def dispose(self):
+        '''Close the connection to the broker. The device stays open in the broker.
+
+        Views returned by FastBlockReadView() are released.
+        '''
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._shm is not None:
+            for ref in list(self._views.values()):
+                view = ref()
+                if view is not None:
+                    try:
+                        view.release()
+                    except BufferError:  # exported by the caller, the segment stays mapped until released
+                        pass
+            self._views.clear()
+            _client_segments.discard(self._shm.name)
+            try:
+                self._shm.close()
+            except BufferError:
+                pass
+            self._shm.unlink()
+            self._shm = None
+
+    def __del__(self):
+        try:
+            self.dispose()
+        except Exception:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m SiLibUSB.broker', description='Share SILAB USB devices between local processes')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='path of the Unix socket')
+    parser.add_argument('--emulate', type=int, default=0, metavar='N', help='serve N emulated devices instead of hardware')
+    args = parser.parse_args(argv)
+
+    if args.emulate:
+        from .emulator import EmulatedDevice
+        devices = [SiUSBDevice(device=EmulatedDevice(board_id=str(i), address=i + 1)) for i in range(args.emulate)]
+    else:
+        devices = GetUSBBoards() or []
+    if not devices:
+        print('No device found')
+        return 1
+    broker = DeviceBroker(devices, args.socket)
+    print('Serving board IDs %s on %s' % (', '.join(sorted(broker.devices.keys())), args.socket))
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+r"""Emulated SILAB USB device.
+
+EmulatedDevice mimics a PyUSB device speaking the SUR protocol on EP1, EP2 and EP6
+and can be passed to SiUSBDevice(device=...). It models the external bus memory,
+the EEPROM (board name and board ID), the firmware version, the 8051 registers and
+the Xilinx configuration pins. An optional link bandwidth and latency is simulated
+by delaying each transfer, which allows benchmarking host-side code without hardware.
+
+Example:
+    dev = SiUSBDevice(device=EmulatedDevice(board_id='123', bandwidth=40e6, latency=125e-6))
+"""
+
+import array
+import ctypes
+import time
+from threading import Lock
+
+import usb.core
+
+from .siusbdevice import SiUSBDevice
+
+
+USBTimeoutError = getattr(usb.core, 'USBTimeoutError', usb.core.USBError)
+
+_SUR_TYPES = dict((getattr(SiUSBDevice, name).id, getattr(SiUSBDevice, name)) for name in dir(SiUSBDevice) if name.startswith('SUR_TYPE_'))
+
+
+class EmulatedDevice(object):
+    '''PyUSB compatible emulation of a SILAB USB device.
+
+    bandwidth: link bandwidth in bytes per second (None for no delay)
+    latency: delay in seconds added to each transfer
+    fast_block_source: callable returning the data (bytes-like) for a fast block read of the
+        given size, by default zeros are returned
+    program_latency: time in seconds after releasing PROG_B during which the Xilinx
+        configuration memory is cleared and configuration data is ignored
+    '''
+    emulated = True
+
+    idVendor = SiUSBDevice.vendor_id
+    idProduct = SiUSBDevice.product_id
+
+    EXTERNAL_SIZE = 0x10000
+    EEPROM_SIZE = 0x4000
+    MEMORY_8051_SIZE = 0x10000
+
+    def __init__(self, board_id='0', board_name='Emulated', fw_version='01', bus=0, address=1, port_numbers=None, bandwidth=None, latency=0.0, fast_block_source=None, program_latency=0.0):
+        self.bus = bus
+        self.address = address
+        self.port_numbers = port_numbers if port_numbers is not None else (address,)
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.fast_block_source = fast_block_source
+        self.program_latency = program_latency
+        self.external = bytearray(self.EXTERNAL_SIZE)
+        self.eeprom = bytearray(self.EEPROM_SIZE)
+        self.memory_8051 = bytearray(self.MEMORY_8051_SIZE)
+        self.i2c = {}
+        self.loop = bytearray()
+        self.fast_block_written = 0
+        self.fw_version = bytearray(fw_version.encode()[:2].ljust(2, b'\0'))
+        name = board_name.encode()[:SiUSBDevice.EEPROM_NAME_SIZE - 1]
+        self.eeprom[SiUSBDevice.EEPROM_NAME_ADDR:SiUSBDevice.EEPROM_NAME_ADDR + 1 + len(name)] = bytearray([len(name)]) + name
+        board_id = board_id.encode()[:SiUSBDevice.EEPROM_ID_SIZE - 2]
+        self.eeprom[SiUSBDevice.EEPROM_ID_ADDR:SiUSBDevice.EEPROM_ID_ADDR + SiUSBDevice.EEPROM_ID_SIZE] = bytearray([len(board_id)]) + board_id.ljust(SiUSBDevice.EEPROM_ID_SIZE - 1, b'\0')
+        # Xilinx configuration
+        self.xilinx_done = False
+        self.xilinx_busy = False
+        self.xilinx_data = bytearray()
+        self._prog = False
+        self._prog_time = 0.0  # time PROG_B was released
+        self._lock = Lock()
+        self._out = None  # pending OUT transaction: [type ID, address, remaining bytes, endpoint]
+        self._in = {}  # pending IN data for each endpoint
+
+    def __repr__(self):
+        return '%s(bus=%d, address=%d)' % (self.__class__.__name__, self.bus, self.address)
+
+    def set_configuration(self, configuration=None):
+        pass
+
+    def reset(self):
+        with self._lock:
+            self._out = None
+            self._in.clear()
+
+    def _delay(self, size):
+        delay = self.latency
+        if self.bandwidth:
+            delay += float(size) / self.bandwidth
+        if delay > 0.0:
+            time.sleep(delay)
+
+    def write(self, endpoint, data, timeout=None):
+        if isinstance(data, array.array):
+            address, size = data.buffer_info()
+            data = bytearray(ctypes.string_at(address, size * data.itemsize))
+        else:
+            data = bytearray(data)
+        self._delay(len(data))
+        with self._lock:
+            if self._out is not None and endpoint == self._out[3]:
+                self._write_payload(data)
+            elif endpoint == SiUSBDevice.SUR_CONTROL_PIPE:
+                self._write_header(data)
+            else:
+                raise USBTimeoutError('No transaction pending on endpoint 0x%02x' % endpoint)
+        return len(data)
+
+    def _write_header(self, data):
+        if len(data) != SiUSBDevice.SUR_HEADER.size:
+            raise usb.core.USBError('Invalid SUR header')
+        type_id, direction, address, size = SiUSBDevice.SUR_HEADER.unpack(bytes(data))
+        try:
+            stype = _SUR_TYPES[type_id]
+        except KeyError:
+            raise usb.core.USBError('Unknown SUR type %d' % type_id)
+        if direction == SiUSBDevice.SUR_DIR_OUT:
+            if size:
+                self._out = [type_id, address, size, stype.ep_write.address]
+        else:
+            self._in[stype.ep_read.address] = [bytes(self._read_data(type_id, address, size)), 0]
+
+    def _write_payload(self, data):
+        type_id, address, remaining, _ = self._out
+        if len(data) > remaining:
+            raise usb.core.USBError('Too much data for transaction')
+        self._write_data(type_id, address, data)
+        self._out[1] += len(data)
+        self._out[2] -= len(data)
+        if self._out[2] == 0:
+            self._out = None
+
+    def _write_data(self, type_id, address, data):
+        if type_id == SiUSBDevice.SUR_TYPE_EXTERNAL.id:
+            self._write_memory(self.external, address, data)
+        elif type_id == SiUSBDevice.SUR_TYPE_EEPROM.id:
+            self._write_memory(self.eeprom, address, data)
+        elif type_id == SiUSBDevice.SUR_TYPE_8051.id:
+            self._write_memory(self.memory_8051, address, data)
+            self._update_xilinx_conf()
+        elif type_id == SiUSBDevice.SUR_TYPE_XILINX.id:
+            self._write_xilinx(data)
+        elif type_id == SiUSBDevice.SUR_TYPE_I2C.id:
+            self.i2c[address] = bytes(data)
+        elif type_id == SiUSBDevice.SUR_TYPE_LOOP.id:
+            self.loop = bytearray(data)
+        elif type_id == SiUSBDevice.SUR_TYPE_GPIFBLOCK.id:
+            self.fast_block_written += len(data)
+
+    def _read_data(self, type_id, address, size):
+        if type_id == SiUSBDevice.SUR_TYPE_EXTERNAL.id:
+            return self._read_memory(self.external, address, size)
+        elif type_id == SiUSBDevice.SUR_TYPE_EEPROM.id:
+            return self._read_memory(self.eeprom, address, size)
+        elif type_id == SiUSBDevice.SUR_TYPE_8051.id:
+            return self._read_memory(self.memory_8051, address, size)
+        elif type_id == SiUSBDevice.SUR_TYPE_FWVER.id:
+            return bytes(self.fw_version[:size])
+        elif type_id == SiUSBDevice.SUR_TYPE_I2C.id:
+            return self.i2c.get(address, b'')[:size].ljust(size, b'\0')
+        elif type_id == SiUSBDevice.SUR_TYPE_LOOP.id:
+            return bytes(self.loop[:size]).ljust(size, b'\0')
+        elif type_id == SiUSBDevice.SUR_TYPE_GPIFBLOCK.id:
+            if self.fast_block_source is None:
+                return bytes(size)
+            return self.fast_block_source(size)
+        return bytes(size)
+
+    def _write_memory(self, memory, address, data):
+        address %= len(memory)
+        end = min(address + len(data), len(memory))
+        memory[address:end] = data[:end - address]
+
+    def _read_memory(self, memory, address, size):
+        address %= len(memory)
+        return bytes(memory[address:address + size]).ljust(size, b'\0')
+
+    def _update_xilinx_conf(self):
+        conf = self.memory_8051[SiUSBDevice.IOA_FX]
+        if not conf & SiUSBDevice.XP_PROG_FX:
+            # PROG_B low clears the configuration
+            self.xilinx_done = False
+            self.xilinx_data = bytearray()
+        elif not self._prog:
+            self._prog_time = time.time()
+        self._prog = bool(conf & SiUSBDevice.XP_PROG_FX)
+        inputs = 0
+        if self.xilinx_done:
+            inputs |= SiUSBDevice.XP_DONE_FX
+        if self.xilinx_busy:
+            inputs |= SiUSBDevice.XP_BUSY_FX
+        self.memory_8051[SiUSBDevice.IOA_FX] = (conf & ~(SiUSBDevice.XP_DONE_FX | SiUSBDevice.XP_BUSY_FX)) | inputs
+
+    def _write_xilinx(self, data):
+        conf = self.memory_8051[SiUSBDevice.IOA_FX]
+        if conf & SiUSBDevice.XP_CS1_FX or conf & SiUSBDevice.XP_RDWR_FX or not conf & SiUSBDevice.XP_PROG_FX:
+            return
+        if time.time() - self._prog_time < self.program_latency:
+            return  # still clearing the configuration memory
+        if self.xilinx_data and len(data) == 8 and not any(data):
+            # start-up clocks after the bitstream
+            self.xilinx_done = True
+        else:
+            self.xilinx_data += data
+        self._update_xilinx_conf()
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        if isinstance(size_or_buffer, array.array):
+            address, size = size_or_buffer.buffer_info()
+            size *= size_or_buffer.itemsize
+        else:
+            address, size = None, size_or_buffer
+        with self._lock:
+            pending = self._in.get(endpoint)
+            if pending is None:
+                raise USBTimeoutError('No data on endpoint 0x%02x' % endpoint)
+            data, offset = pending
+            size = min(size, len(data) - offset)
+            pending[1] += size
+            if pending[1] == len(data):
+                del self._in[endpoint]
+        self._delay(size)
+        if address is None:
+            return array.array('B', data[offset:offset + size])
+        ctypes.memmove(address, ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value + offset, size)
+        return size
+
@@ -0,0 +1,158 @@
+r"""Transfer instrumentation for SILAB USB devices.
+
+instrument() replaces the transfer methods (_write_sur, _write_single, _read_single_into)
+and the lock of a SiUSBDevice object by wrappers recording into a TransferStats object.
+uninstrument() removes the wrappers again, so there is no overhead when disabled.
+"""
+
+import time
+from threading import Lock
+
+import usb.core
+
+
+USBTimeoutError = getattr(usb.core, 'USBTimeoutError', None)
+
+# latency histogram buckets: bucket i counts latencies below 2**i microseconds
+HISTOGRAM_BUCKETS = 32
+
+
+def _is_timeout(error):
+    if USBTimeoutError is not None and isinstance(error, USBTimeoutError):
+        return True
+    return isinstance(error, usb.core.USBError) and getattr(error, 'errno', None) in (60, 110, 10060)
+
+
+class TransferStats(object):
+    '''Transfer statistics of a device.
+
+    Transfers are grouped by operation ('sur' for command headers, 'write' and 'read'
+    for payload), SUR type and endpoint address.
+    '''
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._transfers = {}
+            self.lock_waits = 0
+            self.lock_wait_time = 0.0
+            self.lock_wait_max = 0.0
+
+    def record(self, op, stype, endpoint, size, duration, error=None):
+        key = (op, stype.name, endpoint)
+        bucket = min(int(duration * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        with self._lock:
+            entry = self._transfers.get(key)
+            if entry is None:
+                entry = self._transfers[key] = {'transfers': 0, 'bytes': 0, 'time': 0.0, 'max_time': 0.0, 'errors': 0, 'timeouts': 0, 'histogram': [0] * HISTOGRAM_BUCKETS}
+            entry['transfers'] += 1
+            entry['bytes'] += size
+            entry['time'] += duration
+            if duration > entry['max_time']:
+                entry['max_time'] = duration
+            entry['histogram'][bucket] += 1
+            if error is not None:
+                entry['errors'] += 1
+                if _is_timeout(error):
+                    entry['timeouts'] += 1
+        if self.hook is not None:
+            self.hook({'op': op, 'type': stype.name, 'endpoint': endpoint, 'bytes': size, 'duration': duration, 'error': error})
+
+    def record_lock_wait(self, duration):
+        with self._lock:
+            self.lock_waits += 1
+            self.lock_wait_time += duration
+            if duration > self.lock_wait_max:
+                self.lock_wait_max = duration
+
+    def snapshot(self):
+        '''Return a copy of the statistics as dict.
+
+        The transfers are keyed by "op/type/0xendpoint". Histogram bucket i counts
+        transfers with a latency of less than 2**i microseconds.
+        '''
+        with self._lock:
+            transfers = {}
+            for (op, type_name, endpoint), entry in self._transfers.items():
+                entry = dict(entry)
+                entry['histogram'] = list(entry['histogram'])
+                transfers['%s/%s/0x%02x' % (op, type_name, endpoint)] = entry
+            return {
+                'transfers': transfers,
+                'lock': {'waits': self.lock_waits, 'time': self.lock_wait_time, 'max_time': self.lock_wait_max}
+            }
+
+
+class _InstrumentedLock(object):
+    def __init__(self, lock, stats):
+        self.lock = lock
+        self.stats = stats
+
+    def acquire(self, *args, **kwargs):
+        start = time.perf_counter()
+        ret = self.lock.acquire(*args, **kwargs)
+        self.stats.record_lock_wait(time.perf_counter() - start)
+        return ret
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def instrument(device, stats):
+    write_sur = device._write_sur
+    write_single = device._write_single
+    read_single_into = device._read_single_into
+
+    def _write_sur(stype, direction, address, size):
+        start = time.perf_counter()
+        try:
+            write_sur(stype, direction, address, size)
+        except Exception as e:
+            stats.record('sur', stype, device.SUR_CONTROL_PIPE, device.SUR_HEADER.size, time.perf_counter() - start, e)
+            raise
+        stats.record('sur', stype, device.SUR_CONTROL_PIPE, device.SUR_HEADER.size, time.perf_counter() - start)
+
+    def _write_single(stype, addr, data):
+        start = time.perf_counter()
+        try:
+            write_single(stype, addr, data)
+        except Exception as e:
+            stats.record('write', stype, stype.ep_write.address, len(data), time.perf_counter() - start, e)
+            raise
+        stats.record('write', stype, stype.ep_write.address, len(data), time.perf_counter() - start)
+
+    def _read_single_into(stype, addr, view):
+        start = time.perf_counter()
+        try:
+            read = read_single_into(stype, addr, view)
+        except Exception as e:
+            stats.record('read', stype, stype.ep_read.address, 0, time.perf_counter() - start, e)
+            raise
+        stats.record('read', stype, stype.ep_read.address, read, time.perf_counter() - start)
+        return read
+
+    device._write_sur = _write_sur
+    device._write_single = _write_single
+    device._read_single_into = _read_single_into
+    device.lock = _InstrumentedLock(device.lock, stats)
+
+
+def uninstrument(device):
+    for name in ('_write_sur', '_write_single', '_read_single_into'):
+        device.__dict__.pop(name, None)
+    if isinstance(device.lock, _InstrumentedLock):
+        device.lock = device.lock.lock
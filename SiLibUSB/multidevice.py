@@ -0,0 +1,84 @@
+r"""Operating several SILAB USB devices concurrently.
+
+Each SiUSBDevice has its own device handle and lock, so operations on different
+boards can run in parallel on a pool of worker threads.
+"""
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .siusbdevice import SiUSBDevice, GetUSBDevices
+
+
+BoardResult = namedtuple('BoardResult', ['board', 'value', 'exception', 'duration'])
+BoardResult.__doc__ = '''Result of an operation on a single board.
+
+value is the return value of the operation, exception is set instead if the
+operation failed. duration is the run time in seconds.
+'''
+
+
+def _timed(func, board, args, kwargs):
+    start = time.time()
+    try:
+        value = func(board, *args, **kwargs)
+    except Exception as e:
+        return BoardResult(board, None, e, time.time() - start)
+    return BoardResult(board, value, None, time.time() - start)
+
+
+class SiUSBDevicePool(object):
+    '''Run operations on a list of SiUSBDevice objects concurrently.
+    '''
+
+    def __init__(self, boards, max_workers=None):
+        self.boards = list(boards)
+        self.max_workers = max_workers or max(len(self.boards), 1)
+
+    @classmethod
+    def open_all(cls, max_workers=None, **kwargs):
+        '''Open all connected devices concurrently.
+
+        Devices which could not be opened are skipped. Keyword arguments are passed
+        to SiUSBDevice().
+        '''
+        def open_device(dev):
+            return SiUSBDevice(device=dev, **kwargs)
+
+        devs = GetUSBDevices() or []
+        with ThreadPoolExecutor(max_workers=max_workers or max(len(devs), 1)) as executor:
+            futures = [executor.submit(_timed, open_device, dev, (), {}) for dev in devs]
+            results = [future.result() for future in futures]
+        return cls([result.value for result in results if result.exception is None], max_workers=max_workers)
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __iter__(self):
+        return iter(self.boards)
+
+    def map(self, func, *args, **kwargs):
+        '''Call func(board, *args, **kwargs) for each board concurrently.
+
+        Returns a list of BoardResult in the order of the boards. Exceptions are not
+        raised but returned in the results.
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(_timed, func, board, args, kwargs) for board in self.boards]
+            return [future.result() for future in futures]
+
+    def DownloadXilinx(self, filename, **kwargs):
+        return self.map(SiUSBDevice.DownloadXilinx, filename, **kwargs)
+
+    def EnsureXilinxLoaded(self, filename, **kwargs):
+        return self.map(SiUSBDevice.EnsureXilinxLoaded, filename, **kwargs)
+
+    def identify(self):
+        '''Read board ID, board name and firmware version of each board.
+        '''
+        return self.map(lambda board: {'board_id': board.board_id, 'board_name': board.board_name, 'fw_version': board.fw_version})
+
+    def dispose(self):
+        for board in self.boards:
+            board.dispose()
@@ -0,0 +1,469 @@
+r"""Background readout of SILAB USB devices.
+
+The readout of the fast block interface (EP6) runs in a dedicated thread and fills
+a ring buffer which is allocated once. Consumers take the data out of the ring buffer
+at their own pace. MultiBoardReader reads several boards in parallel, one thread per
+board (libusb releases the GIL during transfers). FastBlockRecorder writes the data
+to disk in a separate writer thread.
+"""
+
+import array
+import os
+import queue
+import struct
+import time
+from collections import namedtuple
+from threading import Thread, Condition, Event, Lock
+
+
+class FastBlockReader(object):
+    '''Read data from the fast block interface in a background thread.
+
+    The ring buffer of buffer_size bytes is divided into slots of chunk_size bytes.
+    The reader thread reads each chunk directly into a free slot. When the ring
+    buffer is full, the reader thread either waits for the consumer (block=True),
+    which stops the readout and lets the FIFO of the device fill up, or reads the
+    chunk into a scratch buffer and discards it (block=False). With count given, the
+    readout stops after count chunks were stored.
+    '''
+
+    def __init__(self, device, buffer_size, chunk_size, block=True, count=None):
+        if chunk_size <= 0 or buffer_size < 2 * chunk_size:
+            raise ValueError('Buffer size must be at least two chunk sizes')
+        self.device = device
+        self.chunk_size = chunk_size
+        self.block = block
+        self.count = count
+        self.slots = buffer_size // chunk_size
+        self._buffer = bytearray(self.slots * chunk_size)
+        view = memoryview(self._buffer)
+        self._views = [view[i * chunk_size:(i + 1) * chunk_size] for i in range(self.slots)]
+        self._lengths = [0] * self.slots
+        self._timestamps = [0.0] * self.slots
+        self._scratch = bytearray(chunk_size)
+        self._cond = Condition()
+        self._thread = None
+        self._running = False
+        self._error = None
+        self._reset()
+
+    def _reset(self):
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+        self._stored = 0
+        self.fill_level = 0
+        self.read_bytes = 0
+        self.overflows = 0
+        self.dropped_bytes = 0
+
+    @property
+    def buffer_size(self):
+        return len(self._buffer)
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            raise RuntimeError('Readout already running')
+        self._reset()
+        self._error = None
+        self._running = True
+        self._thread = Thread(target=self._readout, name='FastBlockReader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''Stop the reader thread. Data in the ring buffer can still be taken out by get().
+        '''
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _readout(self):
+        try:
+            while True:
+                with self._cond:
+                    while self.block and self._count == self.slots and self._running:
+                        self._cond.wait()
+                    if not self._running or (self.count is not None and self._stored >= self.count):
+                        break
+                    full = self._count == self.slots
+                    head = self._head
+                if full:
+                    read = self.device.FastBlockReadInto(self._scratch)
+                    with self._cond:
+                        self.overflows += 1
+                        self.dropped_bytes += read
+                        self.read_bytes += read
+                    continue
+                read = self.device.FastBlockReadInto(self._views[head])
+                if not read:
+                    continue
+                timestamp = time.time()
+                with self._cond:
+                    self._lengths[head] = read
+                    self._timestamps[head] = timestamp
+                    self._head = (head + 1) % self.slots
+                    self._count += 1
+                    self._stored += 1
+                    self.fill_level += read
+                    self.read_bytes += read
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self._error = e
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+    def _wait_chunk(self, block, timeout):
+        # wait for the oldest chunk, called with self._cond held
+        if block and timeout is not None:
+            deadline = time.time() + timeout
+        while self._count == 0:
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            if not block or not self._running:
+                raise queue.Empty
+            if timeout is None:
+                self._cond.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+        return self._tail
+
+    def _release_chunk(self):
+        # free the oldest slot, called with self._cond held
+        self.fill_level -= self._lengths[self._tail]
+        self._tail = (self._tail + 1) % self.slots
+        self._count -= 1
+        self._cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        '''Remove and return the oldest chunk from the ring buffer.
+
+        Raises queue.Empty if no data is available (within timeout) or the readout
+        is stopped and the ring buffer is empty. An exception raised in the reader
+        thread is raised here once all chunks read before the exception are taken out.
+        '''
+        with self._cond:
+            tail = self._wait_chunk(block, timeout)
+            ret = array.array('B')
+            ret.frombytes(self._views[tail][:self._lengths[tail]])
+            self._release_chunk()
+        return ret
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def iter_views(self):
+        '''Yield the chunks as memoryviews of the ring buffer until the readout is stopped and the ring buffer is empty.
+
+        Nothing is copied, a view stays valid until the next iteration which releases its
+        slot. Raises the exception of the reader thread.
+        '''
+        while True:
+            with self._cond:
+                try:
+                    tail = self._wait_chunk(True, None)
+                except queue.Empty:
+                    return
+                view = self._views[tail][:self._lengths[tail]]
+            try:
+                yield view
+            finally:
+                with self._cond:
+                    self._release_chunk()
+
+
+Chunk = namedtuple('Chunk', ['board_id', 'timestamp', 'data'])
+Chunk.__doc__ = '''Data read from a board with the host time (time.time()) when the chunk was queued.
+
+The timestamp is taken after the read finished, for the merged stream while holding
+the merge lock, so timestamps in the merged stream are increasing.
+'''
+
+
+class MultiBoardReader(object):
+    '''Read the fast block interface of several boards in parallel.
+
+    Each board is read by its own thread in chunks of chunk_size bytes. Each chunk is
+    tagged with the board ID and a host timestamp. With merge=True all chunks are
+    delivered through get() in time order, otherwise through the per-board queues
+    in queues (keyed by board ID) or get(board_id). Queues hold at most max_chunks
+    chunks per board, a full queue stops the readout (of all boards for the merged
+    stream) until the consumer catches up.
+
+    If the readout of a board fails, its thread stops and the exception is queued
+    after the chunks read before; get() raises it. Readers of the per-board queues
+    receive the exception object instead of a Chunk. The exceptions are also stored
+    in errors (keyed by board ID).
+    '''
+
+    def __init__(self, devices, chunk_size, merge=True, max_chunks=64):
+        self.devices = list(devices)
+        self.chunk_size = chunk_size
+        self.merge = merge
+        self.max_chunks = max_chunks
+        self.board_ids = [device.board_id for device in self.devices]
+        if len(set(self.board_ids)) != len(self.board_ids):
+            raise ValueError('Board IDs are not unique')
+        self.queues = {}
+        self.errors = {}
+        self.read_bytes = dict((board_id, 0) for board_id in self.board_ids)
+        self._merged = None
+        self._merge_lock = Lock()
+        self._stop = Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        if self.running:
+            raise RuntimeError('Readout already running')
+        self._stop.clear()
+        self.errors = {}
+        if self.merge:
+            self._merged = queue.Queue(self.max_chunks * len(self.devices))
+        else:
+            self.queues = dict((board_id, queue.Queue(self.max_chunks)) for board_id in self.board_ids)
+        self._threads = [Thread(target=self._readout, args=(device, board_id), name='MultiBoardReader-%s' % board_id) for device, board_id in zip(self.devices, self.board_ids)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _put(self, q, chunk):
+        while not self._stop.is_set():
+            try:
+                q.put(chunk, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def _readout(self, device, board_id):
+        try:
+            while not self._stop.is_set():
+                data = device.FastBlockRead(self.chunk_size)
+                if not data:
+                    continue
+                self.read_bytes[board_id] += len(data)
+                if self.merge:
+                    # timestamp and enqueue atomically to keep the merged stream in time order
+                    with self._merge_lock:
+                        if not self._put(self._merged, Chunk(board_id, time.time(), data)):
+                            break
+                else:
+                    if not self._put(self.queues[board_id], Chunk(board_id, time.time(), data)):
+                        break
+        except Exception as e:
+            self.errors[board_id] = e
+            self._put(self._merged if self.merge else self.queues[board_id], e)
+
+    def get(self, block=True, timeout=None, board_id=None):
+        '''Return the next chunk of the merged stream (merge=True) or of board_id (merge=False).
+
+        Raises queue.Empty if no chunk is available within timeout or the readout (of
+        board_id) is stopped and the queue is empty, like FastBlockReader.get(). Raises
+        the exception of a board whose readout failed.
+        '''
+        if self.merge:
+            q = self._merged
+            threads = self._threads
+        elif board_id is None:
+            raise ValueError('Board ID required if merge is False')
+        else:
+            q = self.queues[board_id]
+            threads = self._threads[self.board_ids.index(board_id):][:1]
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            running = any(thread.is_alive() for thread in threads)
+            try:
+                if block and running:
+                    # wake up regularly to notice the end of the readout
+                    item = q.get(True, 0.1 if deadline is None else max(0.0, min(0.1, deadline - time.time())))
+                else:
+                    item = q.get_nowait()
+            except queue.Empty:
+                if not block or not running or (deadline is not None and time.time() >= deadline):
+                    raise
+                continue
+            break
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def get_nowait(self, board_id=None):
+        return self.get(block=False, board_id=board_id)
+
+
+INDEX_ENTRY = struct.Struct('<QQd')
+
+
+def read_index(filename):
+    '''Return the chunk index of a data file written by FastBlockRecorder.
+
+    Returns a list of (offset, size, timestamp) tuples.
+    '''
+    with open(filename + '.idx', 'rb') as f:
+        data = f.read()
+    return [INDEX_ENTRY.unpack_from(data, offset) for offset in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+
+
+class FastBlockRecorder(object):
+    '''Record the fast block interface to disk.
+
+    A FastBlockReader (block=False) reads the data into a ring buffer and a writer
+    thread writes each chunk from the ring buffer to the file with a single unbuffered
+    write, so a slow disk never stops the readout; if the ring buffer runs full, data is
+    dropped and counted in overflows and dropped_bytes. Use a chunk_size which is a
+    multiple of the file system block size.
+
+    For each chunk, (offset, size, timestamp) is appended to the index file
+    (filename + '.idx', see read_index()). With max_file_size set, a new file is started
+    before a file would exceed max_file_size and the files are numbered
+    (run.dat -> run_0000.dat, run_0001.dat, ...). The files are preallocated to
+    max_file_size if supported and truncated to the written size when closed.
+    '''
+
+    def __init__(self, device, filename, chunk_size=2 ** 20, buffer_size=2 ** 26, max_file_size=None, preallocate=True):
+        if max_file_size is not None and max_file_size < chunk_size:
+            raise ValueError('Maximum file size must be at least the chunk size')
+        self.reader = FastBlockReader(device, buffer_size, chunk_size, block=False)
+        self.filename = filename
+        self.max_file_size = max_file_size
+        self.preallocate = preallocate
+        self.files = []
+        self.written_bytes = 0
+        self.error = None
+        self._data_file = None
+        self._index_file = None
+        self._file_offset = 0
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def overflows(self):
+        return self.reader.overflows
+
+    @property
+    def dropped_bytes(self):
+        return self.reader.dropped_bytes
+
+    def _open_file(self):
+        if self.max_file_size is None:
+            filename = self.filename
+        else:
+            root, ext = os.path.splitext(self.filename)
+            filename = '%s_%04d%s' % (root, len(self.files), ext)
+        self._data_file = open(filename, 'wb', buffering=0)
+        self._index_file = open(filename + '.idx', 'wb')
+        self._file_offset = 0
+        self.files.append(filename)
+        if self.preallocate and self.max_file_size is not None and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._data_file.fileno(), 0, self.max_file_size)
+            except OSError:  # not supported by the file system
+                pass
+
+    def _close_file(self):
+        if self._data_file is not None:
+            self._data_file.truncate(self._file_offset)
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = None
+            self._index_file = None
+
+    def start(self):
+        if self.running:
+            raise RuntimeError('Recording already running')
+        self.files = []
+        self.written_bytes = 0
+        self.error = None
+        self._open_file()
+        self.reader.start()
+        self._thread = Thread(target=self._write, name='FastBlockRecorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''Stop the readout, write the data remaining in the ring buffer and close the file.
+        '''
+        self.reader.stop(timeout)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _write(self):
+        reader = self.reader
+        try:
+            while True:
+                with reader._cond:
+                    try:
+                        tail = reader._wait_chunk(True, None)
+                    except queue.Empty:
+                        break
+                    length = reader._lengths[tail]
+                    timestamp = reader._timestamps[tail]
+                # the slot stays owned by the writer until it is released
+                if self.max_file_size is not None and self._file_offset + length > self.max_file_size:
+                    self._close_file()
+                    self._open_file()
+                view = reader._views[tail][:length]
+                written = 0
+                while written < length:
+                    written += self._data_file.write(view[written:])
+                self._index_file.write(INDEX_ENTRY.pack(self._file_offset, length, timestamp))
+                self._file_offset += length
+                self.written_bytes += length
+                with reader._cond:
+                    reader._release_chunk()
+        except Exception as e:
+            self.error = e
+            reader.stop()
+        finally:
+            self._close_file()
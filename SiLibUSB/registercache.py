@@ -0,0 +1,118 @@
+r"""Shadow register cache for the external bus of SILAB USB devices.
+
+Address ranges are declared as cacheable or volatile. Writes to cacheable ranges
+are stored in host memory (write-through) and reads of cacheable ranges are served
+from host memory once all requested bytes are known.
+"""
+
+from threading import Lock
+
+
+class _Region(object):
+    __slots__ = ('start', 'end', 'data', 'valid')
+
+    def __init__(self, start, size):
+        self.start = start
+        self.end = start + size
+        self.data = bytearray(size)
+        self.valid = bytearray(size)
+
+
+class RegisterCache(object):
+    '''Write-through cache of external bus registers.
+
+    Volatile ranges take precedence over cacheable ranges, so a volatile register
+    inside a cacheable block is always read from the device.
+    '''
+
+    def __init__(self):
+        self._regions = []
+        self._volatile = []
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def add_cacheable(self, address, size):
+        if size <= 0:
+            raise ValueError('Size must be positive')
+        with self._lock:
+            for region in self._regions:
+                if address < region.end and region.start < address + size:
+                    raise ValueError('Cacheable range overlaps with existing range 0x%x-0x%x' % (region.start, region.end - 1))
+            self._regions.append(_Region(address, size))
+
+    def add_volatile(self, address, size):
+        if size <= 0:
+            raise ValueError('Size must be positive')
+        with self._lock:
+            self._volatile.append((address, address + size))
+
+    def _is_volatile(self, start, end):
+        for v_start, v_end in self._volatile:
+            if start < v_end and v_start < end:
+                return True
+        return False
+
+    def _find_region(self, start, end):
+        for region in self._regions:
+            if region.start <= start and end <= region.end:
+                return region
+        return None
+
+    def get(self, address, size):
+        '''Return the cached bytes of the range or None if they have to be read from the device.
+        '''
+        end = address + size
+        with self._lock:
+            region = None if self._is_volatile(address, end) else self._find_region(address, end)
+            if region is None:
+                self.bypassed += 1
+                return None
+            start = address - region.start
+            if region.valid.find(b'\x00', start, start + size) != -1:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return bytes(region.data[start:start + size])
+
+    def update(self, address, data):
+        '''Store data written to or read from the device.
+        '''
+        data = memoryview(bytearray(data))
+        end = address + len(data)
+        with self._lock:
+            for region in self._regions:
+                start = max(address, region.start)
+                stop = min(end, region.end)
+                if start >= stop:
+                    continue
+                region.data[start - region.start:stop - region.start] = data[start - address:stop - address]
+                region.valid[start - region.start:stop - region.start] = b'\x01' * (stop - start)
+
+    def invalidate(self, address=None, size=None):
+        '''Invalidate the given range or the whole cache.
+        '''
+        with self._lock:
+            if address is None:
+                for region in self._regions:
+                    region.valid[:] = bytearray(len(region.valid))
+            else:
+                self._invalidate(address, address + (size or 1))
+
+    def _invalidate(self, address, end):
+        for region in self._regions:
+            start = max(address, region.start)
+            stop = min(end, region.end)
+            if start < stop:
+                region.valid[start - region.start:stop - region.start] = bytearray(stop - start)
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.bypassed = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bypassed': self.bypassed}
@@ -81,20 +81,74 @@ HISTORY:
 - fixing classmethod from_board_id() in Python 3
 3.0.2:
 - fixing loading firmware in Python 3
+3.1.0:
+- requires Python 3.8 or later
+- added FastBlockReadInto() and ReadExternalInto() reading into a caller-supplied buffer
+- reading into preallocated buffers instead of concatenating arrays
+- added FastBlockReadStream() iterating over the chunks of a FastBlockReader reading ahead of the consumer
+- added FastBlockReader for readout in a background thread into a ring buffer
+- transfer the payload of each SUR transaction with a single bulk transfer,
+  packetized transfers are still available (packetized=True)
+- added polling of configuration pins to DownloadXilinx() (poll=True) replacing fixed delays
+- reversing bitstream bits with a translation table, caching parsed bitstream files
+- added EnsureXilinxLoaded() skipping the download when the same bitstream is already loaded
+- added SiUSBDevicePool for programming and configuring several boards concurrently
+- caching board ID, board name and firmware version (invalidate_identity() to clear),
+  from_board_id() opens only the known device if the board ID was already read in this process
+- encoding SUR headers with a precompiled struct into a reusable buffer,
+  endpoint and transfer type descriptors are objects with __slots__
+- added batch() merging consecutive writes to the external bus under a single lock acquisition
+- added optional shadow register cache for the external bus (register_cache)
+- added ReadExternalMulti() reading many address ranges with merged transactions
+- added EmulatedDevice for running without hardware,
+  GetBoardId() removes the NUL padding of board IDs shorter than three characters
+- added benchmarks (python -m SiLibUSB.bench)
+- added optional transfer instrumentation (enable_instrumentation())
+- endpoint settings are copied for each device object, added TuneTransferSize() and
+  transfer_size argument to fast block methods
+- timeouts scale with the transfer size, failed transfers raise TransferError
+  (TransferTimeoutError, a usb.core.USBTimeoutError, for timeouts) holding the
+  transferred data, added ResumeTransfer()
+- added AsyncSiUSBDevice (asyncio)
+- writing from buffer-protocol objects without copying, added FastBlockWriteFrom()
+- added MultiBoardReader for parallel readout of several boards
+- added DeviceBroker and SiUSBDeviceProxy sharing devices between local processes
+  (python -m SiLibUSB.broker), bulk data is passed through shared memory
+- added FastBlockRecorder writing the fast block interface to disk in a writer thread
+- added dtype and byteorder arguments to FastBlockRead(), ReadExternal() and FastBlockWrite()
+  for reading into and writing from typed (NumPy) arrays
+- added transaction tracing (enable_tracing()) and trace replay (python -m SiLibUSB.trace)
 """
 
 import usb.core
 import usb.util
 import array
-from threading import Lock
+import ctypes
+from threading import Lock, get_ident
 import struct
 import time
 import os
+import hashlib
+import pickle
+import json
+import logging
+from bisect import bisect_right
+from collections import OrderedDict
 # import platform
 from itertools import chain, islice
-# import sys
-
-__version__ = '3.0.2'
+import sys
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+from .readout import FastBlockReader
+
+__version__ = '3.1.0'
 __version_info__ = (tuple([int(num) for num in __version__.split('.')]), 'final', 0)
 
 # set debugging options for pyUSB
@@ -102,6 +156,268 @@ __version_info__ = (tuple([int(num) for num in __version__.split('.')]), 'final'
 # os.environ['PYUSB_DEBUG_LEVEL'] = 'debug'
 # os.environ['PYUSB_DEBUG'] = 'debug'
 
+# translation table reversing the bit order of a byte
+_BIT_REVERSE_TABLE = bytes(bytearray(int('{0:08b}'.format(i)[::-1], 2) for i in range(256)))
+
+# parsed bitstream files, key is (path, mtime, size)
+_bit_file_cache = OrderedDict()
+_bit_file_cache_lock = Lock()
+_BIT_FILE_CACHE_SIZE = 8
+
+# board ID of the device at a USB location, filled when reading the board ID
+_board_id_index = {}
+
+# serializes access to the file storing the loaded bitstreams within the process,
+# the file is additionally locked with flock() against other processes
+_xilinx_state_lock = Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _byte_view(buf):
+    '''Return a flat unsigned byte memoryview of a buffer-protocol object.
+    '''
+    view = memoryview(buf)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+_BYTEORDER = {'<': 'little', '>': 'big', '=': sys.byteorder, 'native': sys.byteorder, 'little': 'little', 'big': 'big'}
+
+
+def _typed_buffer(size, dtype, byteorder=None):
+    '''Return an empty buffer of size bytes holding items of type dtype.
+
+    With NumPy a NumPy array of the dtype (byte order given by the dtype or byteorder),
+    otherwise an array of the typecode dtype.
+    '''
+    if np is not None:
+        dtype = np.dtype(dtype)
+        if byteorder is not None:
+            dtype = dtype.newbyteorder(byteorder)
+        if size % dtype.itemsize:
+            raise ValueError('Size %d is not a multiple of the item size %d' % (size, dtype.itemsize))
+        return np.empty(size // dtype.itemsize, dtype=dtype)
+    itemsize = array.array(dtype).itemsize
+    if size % itemsize:
+        raise ValueError('Size %d is not a multiple of the item size %d' % (size, itemsize))
+    return array.array(dtype, bytes(size))
+
+
+def _typed_result(buf, read, byteorder=None):
+    '''Trim a buffer from _typed_buffer() to the items read.
+
+    A NumPy array is returned as view, an array is converted in place to native byte order.
+    '''
+    items = read // buf.itemsize
+    if np is not None:
+        return buf[:items]
+    del buf[items:]
+    if byteorder is not None and _BYTEORDER[byteorder] != sys.byteorder:
+        buf.byteswap()
+    return buf
+
+
+def _typed_data(data, dtype, byteorder=None):
+    '''Convert data to items of type dtype in the given byte order, without copying if it already is.
+    '''
+    if np is not None:
+        dtype = np.dtype(dtype)
+        if byteorder is not None:
+            dtype = dtype.newbyteorder(byteorder)
+        return np.ascontiguousarray(data, dtype=dtype)
+    swap = byteorder is not None and _BYTEORDER[byteorder] != sys.byteorder
+    if swap or not isinstance(data, array.array) or data.typecode != dtype:
+        data = array.array(dtype, data)
+    if swap:
+        data.byteswap()
+    return data
+
+
+class SurEndpoint(object):
+    '''Endpoint descriptor: endpoint address, maximum transfer size and maximum packet size.
+    '''
+    __slots__ = ('address', 'maxTransferSize', 'maxPacketSize')
+
+    def __init__(self, address, maxTransferSize, maxPacketSize):
+        self.address = address
+        self.maxTransferSize = maxTransferSize
+        self.maxPacketSize = maxPacketSize
+
+    def __getitem__(self, key):  # dict-style access for backward compatibility
+        return getattr(self, key)
+
+    def copy(self):
+        return self.__class__(self.address, self.maxTransferSize, self.maxPacketSize)
+
+    def __repr__(self):
+        return '%s(address=0x%02x, maxTransferSize=%d, maxPacketSize=%d)' % (self.__class__.__name__, self.address, self.maxTransferSize, self.maxPacketSize)
+
+
+class SurType(object):
+    '''SUR transfer type descriptor: type ID, read endpoint, write endpoint and name.
+    '''
+    __slots__ = ('id', 'ep_read', 'ep_write', 'name')
+
+    def __init__(self, id, ep_read, ep_write, name=None):
+        self.id = id
+        self.ep_read = ep_read
+        self.ep_write = ep_write
+        self.name = name if name is not None else str(id)
+
+    def __getitem__(self, key):  # dict-style access for backward compatibility
+        return getattr(self, key)
+
+    def __repr__(self):
+        return '%s(id=%d, ep_read=%r, ep_write=%r, name=%r)' % (self.__class__.__name__, self.id, self.ep_read, self.ep_write, self.name)
+
+
+class TransferError(usb.core.USBError):
+    '''Transfer failed after transferred bytes.
+
+    For reads, buffer holds the data received so far (data is a view of the valid part).
+    For writes, buffer is the data to be written. Use SiUSBDevice.ResumeTransfer() to
+    continue the transfer from the failure offset.
+    '''
+    def __init__(self, strerror, transferred=0, cause=None):
+        usb.core.USBError.__init__(self, strerror, getattr(cause, 'backend_error_code', None), getattr(cause, 'errno', None))
+        self.transferred = transferred
+        self.cause = cause
+        self.stype = None
+        self.direction = None
+        self.address = None
+        self.buffer = None
+        self.transfer_size = None
+
+    @property
+    def data(self):
+        if self.buffer is None:
+            return None
+        try:
+            return _byte_view(self.buffer)[:self.transferred]
+        except TypeError:
+            return self.buffer[:self.transferred]
+
+
+if hasattr(usb.core, 'USBTimeoutError'):  # PyUSB >= 1.2
+    class TransferTimeoutError(TransferError, usb.core.USBTimeoutError):
+        '''Transfer timed out, also caught by except usb.core.USBTimeoutError.
+        '''
+else:
+    class TransferTimeoutError(TransferError):
+        '''Transfer timed out.
+        '''
+
+
+def _transfer_error(cause, transferred):
+    '''Return a TransferError (TransferTimeoutError for timeouts) for the PyUSB error cause.
+    '''
+    cls = TransferTimeoutError if isinstance(cause, getattr(usb.core, 'USBTimeoutError', ())) else TransferError
+    strerror = getattr(cause, 'strerror', None)
+    return cls(strerror if strerror is not None else str(cause), transferred, cause)
+
+
+def _device_location(dev):
+    '''Return the USB location (bus and port path) of a PyUSB device.
+    '''
+    try:
+        ports = dev.port_numbers
+    except (AttributeError, NotImplementedError, usb.core.USBError):
+        ports = None
+    if ports:
+        return (dev.bus, tuple(ports))
+    return (dev.bus, None, dev.address)
+
+
+def _digits(board_id):
+    return "".join(filter(str.isdigit, board_id))
+
+
+class _ReadBuffer(array.array):
+    '''Array passed to PyUSB read() which points to the memory of another writable buffer.
+
+    PyUSB only reads into array.array objects and its backends only use buffer_info()
+    to locate the memory. Overriding buffer_info() lets libusb write directly into
+    bytearrays, memoryview slices and NumPy arrays without an intermediate copy.
+    '''
+    def __new__(cls, view):
+        self = array.array.__new__(cls, 'B')
+        try:
+            self.target = (ctypes.c_ubyte * len(view)).from_buffer(view)
+        except TypeError:
+            raise TypeError('Buffer must be writable and contiguous')
+        return self
+
+    def buffer_info(self):
+        return ctypes.addressof(self.target), len(self.target)
+
+
+class _WriteBuffer(array.array):
+    '''Array passed to PyUSB write() which points to the memory of another buffer (see _ReadBuffer).
+
+    Slicing returns a new _WriteBuffer for the same memory, so chunks are never copied.
+    '''
+    def __new__(cls, address, length, owner):
+        self = array.array.__new__(cls, 'B')
+        self.address = address
+        self.length = length
+        self.owner = owner  # keeps the memory alive
+        return self
+
+    @classmethod
+    def from_data(cls, data):
+        '''Return a _WriteBuffer for data, copying only if data has no suitable buffer.
+        '''
+        if isinstance(data, cls):
+            return data
+        if isinstance(data, str):
+            data = data.encode('utf-8')  # same as PyUSB
+        if isinstance(data, bytes):
+            return cls(ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value, len(data), data)
+        try:
+            view = memoryview(data)
+        except TypeError:  # sequences of integers
+            view = memoryview(array.array('B', bytearray(data)))
+        if not view.c_contiguous:  # strided buffers are copied
+            view = memoryview(view.tobytes())
+        view = _byte_view(view)
+        if len(view) == 0:
+            return cls(0, 0, None)
+        if view.readonly:
+            if isinstance(view.obj, bytes) and len(view) == len(view.obj):
+                return cls.from_data(view.obj)
+            view = memoryview(bytearray(view))
+        owner = (ctypes.c_ubyte * len(view)).from_buffer(view)
+        return cls(ctypes.addressof(owner), len(view), owner)
+
+    def buffer_info(self):
+        return self.address, self.length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                raise ValueError('Slice step not supported')
+            return _WriteBuffer(self.address + start, max(stop - start, 0), self.owner)
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError('Index out of range')
+        return ctypes.c_ubyte.from_address(self.address + key).value
+
+    def __iter__(self):
+        return iter(bytearray(self.tobytes()))
+
+    def __bytes__(self):
+        return self.tobytes()
+
+    def tobytes(self):
+        return ctypes.string_at(self.address, self.length) if self.length else b''
+
 
 class SiUSBDevice(object):
 
@@ -112,23 +428,26 @@ class SiUSBDevice(object):
     SUR_DATA_FASTOUT_PIPE = 0x02  # 0x02 write EP2
     SUR_DATA_FASTIN_PIPE = 0x86  # 0x86 read EP6
 
-    SUR_EP1_RD = {'address': 0x81, 'maxTransferSize': 0xffff, 'maxPacketSize': 64}
-    SUR_EP1_WR = {'address': 0x01, 'maxTransferSize': 0x8fff, 'maxPacketSize': 64}  # why? 0x8fff exactly 0xa0ff?
-    SUR_EP2_WR = {'address': 0x02, 'maxTransferSize': 2 ** 21, 'maxPacketSize': 2 ** 21}
-    SUR_EP6_RD = {'address': 0x86, 'maxTransferSize': 2 ** 21, 'maxPacketSize': 2 ** 21}
+    SUR_EP1_RD = SurEndpoint(0x81, 0xffff, 64)
+    SUR_EP1_WR = SurEndpoint(0x01, 0x8fff, 64)  # why? 0x8fff exactly 0xa0ff?
+    SUR_EP2_WR = SurEndpoint(0x02, 2 ** 21, 2 ** 21)
+    SUR_EP6_RD = SurEndpoint(0x86, 2 ** 21, 2 ** 21)
 
-    SUR_TYPE_LOOP = {'id': 0, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_8051 = {'id': 1, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_XILINX = {'id': 2, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_EXTERNAL = {'id': 3, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_I2C = {'id': 5, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_EEPROM = {'id': 10, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_FWVER = {'id': 15, 'ep_read': SUR_EP1_RD, 'ep_write': SUR_EP1_WR}
-    SUR_TYPE_GPIFBLOCK = {'id': 17, 'ep_read': SUR_EP6_RD, 'ep_write': SUR_EP2_WR}
+    SUR_TYPE_LOOP = SurType(0, SUR_EP1_RD, SUR_EP1_WR, 'LOOP')
+    SUR_TYPE_8051 = SurType(1, SUR_EP1_RD, SUR_EP1_WR, '8051')
+    SUR_TYPE_XILINX = SurType(2, SUR_EP1_RD, SUR_EP1_WR, 'XILINX')
+    SUR_TYPE_EXTERNAL = SurType(3, SUR_EP1_RD, SUR_EP1_WR, 'EXTERNAL')
+    SUR_TYPE_I2C = SurType(5, SUR_EP1_RD, SUR_EP1_WR, 'I2C')
+    SUR_TYPE_EEPROM = SurType(10, SUR_EP1_RD, SUR_EP1_WR, 'EEPROM')
+    SUR_TYPE_FWVER = SurType(15, SUR_EP1_RD, SUR_EP1_WR, 'FWVER')
+    SUR_TYPE_GPIFBLOCK = SurType(17, SUR_EP6_RD, SUR_EP2_WR, 'GPIFBLOCK')
 
     SUR_DIR_OUT = 0x00
     SUR_DIR_IN = 0x01
 
+    # SUR header: type ID, direction, address, size
+    SUR_HEADER = struct.Struct('<BBII')
+
     EEPROM_OFFSET_ADDR = 0x3000
     EEPROM_MFG_ADDR = (EEPROM_OFFSET_ADDR)
     EEPROM_MFG_SIZE = 21
@@ -155,11 +474,23 @@ class SiUSBDevice(object):
     xp_prog = XP_PROG_FX
     xp_done = XP_DONE_FX
 
+    # directory for storing parsed bitstream files, if None parsed files are only cached in memory
+    bitstream_cache_dir = None
+    # file storing the hash of the last downloaded bitstream for each board ID (used by EnsureXilinxLoaded()), None to disable
+    xilinx_state_file = os.path.join(os.path.expanduser('~'), '.pySiLibUSB_xilinx.json')
+
     # compatible usb devices
     vendor_id = 0x5312
     product_id = 0x0200
 
-    def __init__(self, device=None):
+    def __init__(self, device=None, packetized=False, tune_transfer_size=False):
+        '''Open SILAB USB device.
+
+        If packetized is True, the payload of each transaction is transferred in chunks
+        of the maximum packet size of the endpoint (one libusb call per packet). Otherwise
+        the payload is handed to libusb at once, which splits it into packets.
+        If tune_transfer_size is True, TuneTransferSize() is called after opening the device.
+        '''
 
         # import usb.backend.libusb0 as libusb0
         # backend_usb0 = libusb0.get_backend()
@@ -170,7 +501,7 @@ class SiUSBDevice(object):
             if self.dev is None:
                 raise ValueError('No device found')
         else:
-            if isinstance(device, usb.core.Device):
+            if isinstance(device, usb.core.Device) or getattr(device, 'emulated', False):
                 self.dev = device
                 if self.dev.idVendor != self.vendor_id or self.dev.idProduct != self.product_id:
                     raise ValueError('Device has wrong vendor/product ID')
@@ -183,10 +514,40 @@ class SiUSBDevice(object):
 
         self.dev.set_configuration()
 
+        self.packetized = packetized
+        self.timeout = 1000  # minimum timeout in ms
+        self.timeout_factor = 4.0  # allowed slowdown compared to link_speed before timing out
+        self.link_speed = 8e6  # expected link speed in bytes/s, updated by TuneTransferSize()
         self.lock = Lock()
+        self._batch_thread = None  # thread holding the lock in batch()
+        self._copy_transfer_types()
+        self._identity = {}
+        self.register_cache = None  # RegisterCache serving reads of cacheable external bus registers
+        self.transfer_stats = None
+        self.tracer = None
+        self._sur_header = array.array('B', [0]) * self.SUR_HEADER.size
+
+        if tune_transfer_size:
+            self.TuneTransferSize()
+
+    def _copy_transfer_types(self):
+        # endpoint settings can be changed for each device object without affecting other objects
+        cls = self.__class__
+        endpoints = {}
+        for name in dir(cls):
+            value = getattr(cls, name)
+            if isinstance(value, SurEndpoint):
+                endpoints[id(value)] = value.copy()
+                setattr(self, name, endpoints[id(value)])
+        for name in dir(cls):
+            value = getattr(cls, name)
+            if isinstance(value, SurType):
+                ep_read = endpoints.get(id(value.ep_read)) or value.ep_read.copy()
+                ep_write = endpoints.get(id(value.ep_write)) or value.ep_write.copy()
+                setattr(self, name, SurType(value.id, ep_read, ep_write, value.name))
 
     def __repr__(self):
-        return '%s' % filter(type(self.board_id).isdigit, self.board_id)
+        return '%s' % _digits(self.board_id)
 
     @classmethod
     def from_board_id(cls, board_id):
@@ -196,6 +557,23 @@ class SiUSBDevice(object):
         if devs is None or not devs or None in devs:
             raise ValueError('No device found')
 
+        # try the device where the board ID was found before
+        known_devs = [dev for dev in devs if _digits(_board_id_index.get(_device_location(dev), '')) == str(board_id)]
+        if len(known_devs) == 1:
+            try:
+                board = cls(device=known_devs[0])
+            except usb.core.USBError:
+                pass
+            else:
+                try:
+                    curr_board_id = board.GetBoardId()
+                except usb.core.USBError:
+                    board.dispose()
+                else:
+                    if _digits(curr_board_id) == str(board_id):
+                        return board
+                    board.dispose()
+
         boards = []
         for dev in devs:
             try:
@@ -208,7 +586,7 @@ class SiUSBDevice(object):
                 except usb.core.USBError:
                     pass
                 else:
-                    if "".join(filter(str.isdigit, curr_board_id)) == str(board_id):
+                    if _digits(curr_board_id) == str(board_id):
                         boards.append(board)
                     else:
                         board.dispose()
@@ -221,29 +599,255 @@ class SiUSBDevice(object):
 
     @property
     def board_id(self):
-        return self.GetBoardId()
+        try:
+            return self._identity['board_id']
+        except KeyError:
+            return self.GetBoardId()
 
     @property
     def board_name(self):
-        return self.GetName()
+        try:
+            return self._identity['board_name']
+        except KeyError:
+            return self.GetName()
 
     @property
     def fw_version(self):
-        return self.GetFWVersion()
+        try:
+            return self._identity['fw_version']
+        except KeyError:
+            return self.GetFWVersion()
+
+    def invalidate_identity(self):
+        '''Clear the cached board ID, board name and firmware version.
+
+        The properties board_id, board_name and fw_version read from the device again on next access.
+        '''
+        self._identity.clear()
 
     def WriteExternal(self, address, data):
-        self._write(self.SUR_TYPE_EXTERNAL, address, data)
+        if self.register_cache is None:
+            self._write(self.SUR_TYPE_EXTERNAL, address, data)
+        else:
+            # byte length and content for the cache (str, typed buffers)
+            data = _WriteBuffer.from_data(data)
+            try:
+                self._write(self.SUR_TYPE_EXTERNAL, address, data)
+            except Exception:
+                self.register_cache.invalidate(address, max(len(data), 1))
+                raise
+            self._update_register_cache(address, data.tobytes())
 
-    def ReadExternal(self, address, size):
-        return self._read(self.SUR_TYPE_EXTERNAL, address, size)
+    def ReadExternal(self, address, size, dtype=None, byteorder=None):
+        '''Read size bytes from the external bus.
 
-    def FastBlockWrite(self, data):
-        self._write(self.SUR_TYPE_GPIFBLOCK, 0, data)
+        Returns an array of bytes, or with dtype given the data as items of type dtype
+        (see FastBlockRead()).
+        '''
+        if dtype is not None:
+            buf = _typed_buffer(size, dtype, byteorder)
+            return _typed_result(buf, self.ReadExternalInto(address, buf), byteorder)
+        if self.register_cache is not None:
+            cached = self.register_cache.get(address, size)
+            if cached is not None:
+                ret = array.array('B')
+                ret.frombytes(cached)
+                return ret
+        ret = self._read(self.SUR_TYPE_EXTERNAL, address, size)
+        if self.register_cache is not None and len(ret) == size:
+            self.register_cache.update(address, ret)
+        return ret
 
-    def FastBlockRead(self, size):
-        return self._read(self.SUR_TYPE_GPIFBLOCK, 0, size)
+    def ReadExternalInto(self, address, buf):
+        '''Read len(buf) bytes into the writable buffer buf and return the number of bytes read.
+        '''
+        if self.register_cache is None:
+            return self._read_into(self.SUR_TYPE_EXTERNAL, address, buf)
+        view = _byte_view(buf)
+        cached = self.register_cache.get(address, len(view))
+        if cached is not None:
+            view[:] = cached
+            return len(view)
+        read = self._read_into(self.SUR_TYPE_EXTERNAL, address, view)
+        if read == len(view):
+            self.register_cache.update(address, view)
+        return read
+
+    def ReadExternalMulti(self, ranges, max_gap=16):
+        '''Read several address ranges, given as a list of (address, size) tuples.
+
+        Ranges which are less than or equal to max_gap bytes apart are merged into a
+        single transaction and all transactions are done under a single lock acquisition.
+        The bytes between merged ranges are read as well, use max_gap=0 if reading
+        them has side effects. Returns a memoryview for each range in the given order.
+        '''
+        blocks = []
+        for address, size in sorted(ranges):
+            if blocks and address <= blocks[-1][1] + max_gap:
+                blocks[-1][1] = max(blocks[-1][1], address + size)
+            else:
+                blocks.append([address, address + size])
+        buf = bytearray(sum(end - start for start, end in blocks))
+        view = memoryview(buf)
+        offsets = []
+        offset = 0
+        self._check_batch()
+        with self.lock:
+            for start, end in blocks:
+                read = self._read_transfers(self.SUR_TYPE_EXTERNAL, start, view[offset:offset + end - start])
+                if read != end - start:
+                    raise usb.core.USBError('Read %d of %d bytes from address 0x%x' % (read, end - start, start))
+                offsets.append(offset)
+                offset += end - start
+        if self.register_cache is not None:
+            for (start, end), offset in zip(blocks, offsets):
+                self.register_cache.update(start, view[offset:offset + end - start])
+        starts = [start for start, _ in blocks]
+        ret = []
+        for address, size in ranges:
+            i = bisect_right(starts, address) - 1
+            offset = offsets[i] + address - starts[i]
+            ret.append(view[offset:offset + size])
+        return ret
+
+    def _update_register_cache(self, address, data):
+        max_size = self.SUR_TYPE_EXTERNAL.ep_write.maxTransferSize
+        if len(data) > max_size:
+            # transactions of a large write all start at the same address
+            self.register_cache.invalidate(address, max_size)
+        else:
+            self.register_cache.update(address, data)
+
+    def FastBlockWrite(self, data, transfer_size=None, dtype=None, byteorder=None):
+        '''Write data to the fast block interface.
+
+        With dtype given, data (e.g. a list of 32-bit words) is written as items of type
+        dtype in the given byte order, e.g. dtype='>u4' or dtype='I', byteorder='big'.
+        Buffers which already have that type are written without copying.
+        '''
+        if dtype is not None:
+            data = _typed_data(data, dtype, byteorder)
+        self._write(self.SUR_TYPE_GPIFBLOCK, 0, data, transfer_size)
+
+    def FastBlockWriteFrom(self, source, chunk_size=None):
+        '''Write data from a file object or an iterable of buffers to the fast block interface.
+
+        Files are read in chunks of chunk_size bytes (default: maximum transfer size) into
+        a single reused buffer, so large files are never loaded completely into memory.
+        Returns the number of bytes written.
+        '''
+        written = 0
+        if hasattr(source, 'readinto') or hasattr(source, 'read'):
+            if chunk_size is None:
+                chunk_size = self.SUR_TYPE_GPIFBLOCK.ep_write.maxTransferSize
+            if hasattr(source, 'readinto'):
+                buf = bytearray(chunk_size)
+                view = memoryview(buf)
+                while True:
+                    size = source.readinto(buf)
+                    if not size:
+                        break
+                    self.FastBlockWrite(view[:size])
+                    written += size
+            else:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    self.FastBlockWrite(chunk)
+                    written += len(chunk)
+        else:
+            for chunk in source:
+                self.FastBlockWrite(chunk)
+                written += len(chunk)
+        return written
+
+    def FastBlockRead(self, size, transfer_size=None, dtype=None, byteorder=None):
+        '''Read up to size bytes from the fast block interface.
+
+        Returns an array of bytes. With dtype given, the data is read directly into a
+        typed buffer: with NumPy a NumPy array of the dtype (e.g. dtype='>u4' or
+        dtype='u4', byteorder='big' for big-endian 32-bit words), otherwise an array of
+        the typecode dtype (e.g. 'I') converted to native byte order. size must be a
+        multiple of the item size, an incomplete trailing item of a short read is dropped.
+        '''
+        if dtype is not None:
+            buf = _typed_buffer(size, dtype, byteorder)
+            return _typed_result(buf, self._read_into(self.SUR_TYPE_GPIFBLOCK, 0, buf, transfer_size), byteorder)
+        return self._read(self.SUR_TYPE_GPIFBLOCK, 0, size, transfer_size)
+
+    def FastBlockReadInto(self, buf, transfer_size=None):
+        '''Read len(buf) bytes into the writable buffer buf and return the number of bytes read.
+
+        The buffer can be a bytearray, array, memoryview or NumPy array and may be reused
+        for every readout.
+        '''
+        return self._read_into(self.SUR_TYPE_GPIFBLOCK, 0, buf, transfer_size)
+
+    def TuneTransferSize(self, candidates=None, total_size=2 ** 22, repeat=3, directions=('read', 'write')):
+        '''Measure fast block throughput for each candidate transfer size and use the fastest.
+
+        The best transfer sizes are stored for this device object only (SUR_EP6_RD for reading,
+        SUR_EP2_WR for writing). Note that tuning reads data from and writes zeros to the fast
+        block interface, select the directions accordingly. Returns a dict with the best
+        transfer size and the throughput in MB/s of each candidate per direction.
+        '''
+        if candidates is None:
+            candidates = [2 ** i for i in range(14, 23)]
+        buf = bytearray(total_size)
+        ret = {}
+        for direction in directions:
+            if direction == 'read':
+                endpoint = self.SUR_TYPE_GPIFBLOCK.ep_read
+
+                def transfer(transfer_size):
+                    self.FastBlockReadInto(buf, transfer_size=transfer_size)
+            elif direction == 'write':
+                endpoint = self.SUR_TYPE_GPIFBLOCK.ep_write
+
+                def transfer(transfer_size):
+                    self.FastBlockWrite(buf, transfer_size=transfer_size)
+            else:
+                raise ValueError('Unknown direction %s' % direction)
+            throughput = {}
+            for transfer_size in candidates:
+                transfer(transfer_size)  # warm-up
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    transfer(transfer_size)
+                    duration = time.time() - start
+                    best = duration if best is None else min(best, duration)
+                throughput[transfer_size] = total_size / max(best, 1e-9) / 2 ** 20
+            best_size = max(throughput, key=throughput.get)
+            endpoint.maxTransferSize = best_size
+            endpoint.maxPacketSize = best_size
+            ret[direction] = {'transfer_size': best_size, 'throughput': throughput}
+        if ret:
+            # timeouts are based on the slowest direction
+            self.link_speed = min(result['throughput'][result['transfer_size']] for result in ret.values()) * 2 ** 20
+        return ret
+
+    def FastBlockReadStream(self, chunk_size, depth=4, count=None):
+        '''Continuously read chunks of chunk_size bytes from EP6.
+
+        Runs a FastBlockReader (see SiLibUSB.readout) with a ring buffer of depth chunks,
+        its thread reads up to depth chunks ahead of the caller. Yields a memoryview of
+        the ring buffer per chunk which stays valid until the next iteration. Reads count
+        chunks or runs until the generator is closed.
+        '''
+        if depth < 2:
+            raise ValueError('Depth must be at least 2')
+        reader = FastBlockReader(self, depth * chunk_size, chunk_size, block=True, count=count)
+        reader.start()
+        try:
+            for view in reader.iter_views():
+                yield view
+        finally:
+            reader.stop()
 
     def WriteEEPROM(self, address, data):
+        self.invalidate_identity()
         return self._write(self.SUR_TYPE_EEPROM, address, data)
 
     def ReadEEPROM(self, address, size):
@@ -255,6 +859,68 @@ class SiUSBDevice(object):
     def ReadI2C(self, address, size):
         return self._read(self.SUR_TYPE_I2C, address, size)
 
+    def enable_instrumentation(self, hook=None):
+        '''Record transfer statistics and return the TransferStats object.
+
+        Counts bytes and transfers per SUR type and endpoint, errors and timeouts,
+        lock wait time and latency histograms. If given, hook is called with an event
+        dict for each transfer. Instrumentation wraps the transfer methods and the lock
+        of this object and adds no overhead when disabled. Do not enable or disable it
+        while other threads access the device.
+        '''
+        from .instrumentation import TransferStats, instrument
+        if self.transfer_stats is not None:
+            self.disable_instrumentation()
+        self.transfer_stats = TransferStats(hook=hook)
+        instrument(self, self.transfer_stats)
+        return self.transfer_stats
+
+    def disable_instrumentation(self):
+        from .instrumentation import uninstrument
+        if self.transfer_stats is not None:
+            uninstrument(self)
+            self.transfer_stats = None
+
+    def enable_tracing(self, filename, digest_limit=2 ** 16, payloads=False):
+        '''Record all SUR transactions to the trace file filename and return the TransferTracer object.
+
+        Each transaction is stored with a digest of the first digest_limit bytes of its
+        payload (None for all), with payloads=True also the data of writes. Traces are
+        shown and replayed with python -m SiLibUSB.trace. Like instrumentation, tracing
+        wraps the transfer methods; disable both in the reverse order of enabling.
+        '''
+        from .trace import TransferTracer, trace
+        if self.tracer is not None:
+            self.disable_tracing()
+        self.tracer = TransferTracer(filename, digest_limit=digest_limit, payloads=payloads, metadata={'board_id': self._identity.get('board_id'), 'fw_version': self._identity.get('fw_version')})
+        trace(self, self.tracer)
+        return self.tracer
+
+    def disable_tracing(self):
+        from .trace import untrace
+        if self.tracer is not None:
+            untrace(self)
+            self.tracer.close()
+            self.tracer = None
+
+    def batch(self):
+        '''Return a context manager for a batch of external bus accesses.
+
+        The device lock is held for the whole batch. Writes to consecutive addresses
+        are merged into a single transaction and sent before the next read, when
+        the address is not consecutive, or at the end of the batch. Pending writes
+        are discarded if the batch is left with an exception. Inside the batch, access
+        the device only through the batch object; calling methods of the device
+        (e.g. dev.ReadExternal()) raises RuntimeError since the lock is not reentrant.
+
+        Example:
+            with dev.batch() as b:
+                b.write(0x0000, [0xa0])
+                b.write(0x0001, [0x64, 0x00])  # merged with previous write
+                data = b.read(0x0000, 16)  # flushes pending writes
+        '''
+        return SiUSBBatch(self)
+
     @staticmethod
     def chunk(iterable, n):
         iterable = iter(iterable)
@@ -267,80 +933,161 @@ class SiUSBDevice(object):
         while True:
             yield chain([next(iterable)], islice(iterable, n - 1))
 
-    def _write(self, stype, addr, data):
+    def _get_timeout(self, size):
+        '''Return timeout in ms for a transfer of size bytes.
+        '''
+        return int(self.timeout + self.timeout_factor * 1000.0 * size / self.link_speed)
+
+    def ResumeTransfer(self, error):
+        '''Continue a transfer which failed with TransferError from the failure offset.
+
+        Returns the total number of bytes transferred. For reads, the data is in error.buffer.
+        Raises TransferError again (relative to the original transfer) if the transfer fails.
+        '''
+        done = error.transferred
+        try:
+            if error.direction == self.SUR_DIR_IN:
+                view = _byte_view(error.buffer)
+                return done + self._read_into(error.stype, error.address + done, view[done:], error.transfer_size)
+            else:
+                self._write(error.stype, error.address, error.buffer[done:], error.transfer_size)
+                return len(error.buffer)
+        except TransferError as e:
+            e.transferred += done
+            e.address = error.address
+            e.buffer = error.buffer
+            raise
+
+    def _write(self, stype, addr, data, transfer_size=None):
+        max_size = transfer_size or stype.ep_write.maxTransferSize
+        if isinstance(data, (list, tuple)):
+            data = array.array('B', data)
+        if type(data) is array.array and data.typecode == 'B' and len(data) <= max_size:
+            buf = data  # single transfer, passed to PyUSB as it is
+        else:
+            buf = _WriteBuffer.from_data(data)
+        self._check_batch()
         with self.lock:
-            max_size = stype['ep_write']['maxTransferSize']
             val = 0
-            while val < len(data):
-                self._write_single(stype, addr, data[val:val + max_size])
-                val += max_size
-#                 addr += max_size  # FIXME: addr should also be increased, but does not work
+            try:
+                while val < len(buf):
+                    self._write_single(stype, addr, buf[val:val + max_size])
+                    val += max_size
+#                     addr += max_size  # FIXME: addr should also be increased, but does not work
+            except TransferError as e:
+                e.transferred += val
+                e.stype, e.direction, e.address, e.buffer, e.transfer_size = stype, self.SUR_DIR_OUT, addr, data, transfer_size
+                raise
+
+    def _check_batch(self):
+        # the lock is not reentrant, accessing the device directly inside batch() would deadlock
+        if self._batch_thread is not None and self._batch_thread == get_ident():
+            raise RuntimeError('Device accessed directly inside batch(), use the methods of the batch object')
 
     def _write_single(self, stype, addr, data):
         self._write_sur(stype, self.SUR_DIR_OUT, addr, len(data))
-        max_size = stype['ep_write']['maxPacketSize']
-        ep = stype['ep_write']['address']
+        ep = stype.ep_write.address
+        if not self.packetized:
+            try:
+                self.dev.write(ep, data, timeout=self._get_timeout(len(data)))
+            except usb.core.USBError as e:
+                raise _transfer_error(e, 0)
+            return
+        max_size = stype.ep_write.maxPacketSize
         val = 0
-        while val < len(data):
-            self.dev.write(ep, data[val:val + max_size], timeout=1000)
-            val += max_size
-
-    def _read(self, stype, addr, size):
-        with self.lock:
-            max_size = stype['ep_read']['maxTransferSize']
-            ret = array.array('B')
-            val = addr
-            while val < addr + size - max_size:
-                ret += self._read_single(stype, val, max_size)
+        try:
+            while val < len(data):
+                self.dev.write(ep, data[val:val + max_size], timeout=self._get_timeout(max_size))
                 val += max_size
-            ret += self._read_single(stype, val, size - val + addr)
+        except usb.core.USBError as e:
+            raise _transfer_error(e, val)
+
+    def _read(self, stype, addr, size, transfer_size=None):
+        ret = array.array('B', [0]) * size
+        try:
+            read = self._read_into(stype, addr, ret, transfer_size)
+        except TransferError as e:
+            e.buffer = ret
+            raise
+        del ret[read:]
         return ret
 
+    def _read_into(self, stype, addr, buf, transfer_size=None):
+        view = _byte_view(buf)
+        self._check_batch()
+        try:
+            with self.lock:
+                return self._read_transfers(stype, addr, view, transfer_size)
+        except TransferError as e:
+            e.stype, e.direction, e.address, e.buffer, e.transfer_size = stype, self.SUR_DIR_IN, addr, buf, transfer_size
+            raise
+
+    def _read_transfers(self, stype, addr, view, transfer_size=None):
+        size = len(view)
+        max_size = transfer_size or stype.ep_read.maxTransferSize
+        val = 0
+        read = 0
+        try:
+            while val < size:
+                transfer_size = min(max_size, size - val)
+                read += self._read_single_into(stype, addr + val, view[read:read + transfer_size])
+                val += transfer_size
+        except TransferError as e:
+            e.transferred += read
+            raise
+        return read
+
     def _read_single(self, stype, addr, size):
-        ret = array.array('B')
+        ret = array.array('B', [0]) * size
+        read = self._read_single_into(stype, addr, memoryview(ret))
+        del ret[read:]
+        return ret
+
+    def _read_single_into(self, stype, addr, view):
+        size = len(view)
         if size == 0:
-            return ret
+            return 0
         self._write_sur(stype, self.SUR_DIR_IN, addr, size)
-        max_size = stype['ep_read']['maxPacketSize']
-        ep = stype['ep_read']['address']
-        val = max_size
-        while val < size:
-            ret += self.dev.read(ep, max_size, timeout=1000)
-            val += max_size
-        ret += self.dev.read(ep, size + max_size - val, timeout=1000)
-        return ret
+        max_size = stype.ep_read.maxPacketSize if self.packetized else size
+        ep = stype.ep_read.address
+        timeout = self._get_timeout(min(max_size, size))
+        val = 0
+        read = 0
+        try:
+            while val < size:
+                packet_size = min(max_size, size - read)
+                if packet_size:
+                    read += self.dev.read(ep, _ReadBuffer(view[read:read + packet_size]), timeout=timeout)
+                val += max_size
+        except usb.core.USBError as e:
+            raise _transfer_error(e, read)
+        return read
 
     def _write_sur(self, stype, direction, address, size):
-        a_size = array.array('B', struct.pack('I', size))
-        a_size.byteswap()
-        a_addr = array.array('B', struct.pack('I', address))
-        a_addr.byteswap()
-        ar = array.array('B', [stype['id'], direction]) + a_addr + a_size
-        self.dev.write(self.SUR_CONTROL_PIPE, ar, timeout=1000)
+        self.SUR_HEADER.pack_into(self._sur_header, 0, stype.id, direction, address, size)
+        self.dev.write(self.SUR_CONTROL_PIPE, self._sur_header, timeout=self.timeout)
 
     def GetFWVersion(self):
         ret = self._read(self.SUR_TYPE_FWVER, 0, 2)
-        try:
-            return ret.tobytes().decode("utf-8", "ignore")
-        except AttributeError:
-            return ret.tostring()
+        fw_version = ret.tobytes().decode("utf-8", "ignore")
+        self._identity['fw_version'] = fw_version
+        return fw_version
 
     def GetName(self):
         ret = self.ReadEEPROM(self.EEPROM_NAME_ADDR, self.EEPROM_NAME_SIZE)
-        try:
-            return ret[1:1 + ret[0]].tobytes().decode("utf-8", "ignore")
-        except AttributeError:
-            return ret[1:1 + ret[0]].tostring()
+        board_name = ret[1:1 + ret[0]].tobytes().decode("utf-8", "ignore")
+        self._identity['board_name'] = board_name
+        return board_name
 
     def SetName(self, name):
         raise NotImplementedError()
 
     def GetBoardId(self):
         ret = self.ReadEEPROM(self.EEPROM_ID_ADDR, self.EEPROM_ID_SIZE)
-        try:
-            return ret[1:-1].tobytes().decode("utf-8", "ignore")
-        except AttributeError:
-            return ret[1:-1].tostring()
+        board_id = ret[1:-1].tobytes().rstrip(b'\0').decode("utf-8", "ignore")  # IDs shorter than 3 characters are NUL padded
+        self._identity['board_id'] = board_id
+        _board_id_index[_device_location(self.dev)] = board_id
+        return board_id
 
     def SetBoardId(self, board_id):
         raise NotImplementedError()
@@ -365,6 +1112,53 @@ class SiUSBDevice(object):
         return letter, f.read(alen)
 
     def _read_bit_file(self, bit_file_name):
+        ret = dict(self._get_bit_file(bit_file_name))
+        ret["Bitstream"] = bytearray(ret["Bitstream"])
+        return ret
+
+    def _get_bit_file(self, bit_file_name):
+        # returns the cached dict, must not be modified
+        stat = os.stat(bit_file_name)
+        key = (os.path.abspath(bit_file_name), stat.st_mtime, stat.st_size)
+        with _bit_file_cache_lock:
+            ret = _bit_file_cache.get(key)
+            if ret is not None:
+                _bit_file_cache.move_to_end(key)
+                return ret
+        cache_file = None
+        if self.bitstream_cache_dir is not None:
+            cache_file = os.path.join(self.bitstream_cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pickle')
+            try:
+                with open(cache_file, "rb") as f:
+                    ret = pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                ret = None
+        if ret is None:
+            ret = self._parse_bit_file(bit_file_name)
+            if cache_file is not None:
+                self._write_bit_file_cache(cache_file, ret)
+        with _bit_file_cache_lock:
+            _bit_file_cache[key] = ret
+            _bit_file_cache.move_to_end(key)
+            while len(_bit_file_cache) > _BIT_FILE_CACHE_SIZE:
+                _bit_file_cache.popitem(last=False)
+        return ret
+
+    def _write_bit_file_cache(self, cache_file, bit_file):
+        # the on-disk cache is best-effort, failing to write it does not fail the download
+        tmp_file = cache_file + '.%d.%d.tmp' % (os.getpid(), get_ident())
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(bit_file, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            logger.warning('Cannot write bitstream cache %s: %s', cache_file, e)
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+
+    def _parse_bit_file(self, bit_file_name):
         with open(bit_file_name, "rb") as f:
             head13 = array.array('B', f.read(13))
             if head13.tolist() != [0, 9, 15, 240, 15, 240, 15, 240, 15, 240, 0, 0, 1]:
@@ -387,18 +1181,8 @@ class SiUSBDevice(object):
             # bitstream = f.read(bitstream_len[0])
             bitstream_len = c[0] * (2 ** 24) + c[1] * (2 ** 16) + c[2] * (2 ** 8) + c[3]
 
-            bitstream = bytearray(f.read(bitstream_len))
-
-            bs = array.array('B', bitstream)
-
-            def reverse(byte):
-                return (b * 0x0202020202 & 0x010884422010) % 1023
-
-            # reverse bytes
-            for i, b in enumerate(bs):
-                bitstream[i] = reverse(b)
-
-            ret["Bitstream"] = bitstream
+            # reverse bits of each byte
+            ret["Bitstream"] = bytes(f.read(bitstream_len)).translate(_BIT_REVERSE_TABLE)
             return ret
 
     def InitXilinxConfPort(self):
@@ -418,77 +1202,175 @@ class SiUSBDevice(object):
         portreg |= self.xp_cs1  # /* write, OE = 1 */
         self._Write8051(self.OEA_FX, [portreg])
 
-    def DownloadXilinx(self, filename):
+    def DownloadXilinx(self, filename, poll=False, hold_time=0.001, prog_hold_time=0.1, timeout=5.0, record=False):
         r"""Configure FPGA.
 
         The filename name of the bitstream file (*.bin) or (*.bit)
         During bit generation Start-Up Clock has to be set to CCLK.
         To create *.bin file from *.bit file use impact or: "promgen -u 0 filename.bit -p bin -w"
         The possible return values are True or False.
+
+        If poll is False, fixed delays are inserted between the configuration steps.
+        If poll is True, each step is held for at least hold_time seconds and the
+        configuration pins are polled instead (DONE low after PROG_B, BUSY low before
+        writing, DONE high after start-up), waiting at most timeout seconds for each.
+        INIT_B is not connected, after releasing PROG_B the FPGA clears its configuration
+        memory for prog_hold_time seconds, which must cover the program latency of the part.
+        If a pin does not reach its level in time, the configuration is aborted
+        (CS_B and WRITE_B released, no further data written) and False is returned.
+
+        If record is True, the hash of the bitstream is stored in xilinx_state_file
+        for EnsureXilinxLoaded(). Failing to write the file is logged and does not
+        fail the download.
         """
-        bitstream = array.array('B')
+        def delay(seconds):
+            time.sleep(hold_time if poll else seconds)
 
-        extension = os.path.splitext(filename)[1]
-        if extension == '.bin':
-            with open(filename, "rb") as f:
-                fsize = os.path.getsize(filename)
-                bitstream.fromfile(f, fsize)
-        elif extension == '.bit':
-            bitstream = array.array('B', self._read_bit_file(filename)["Bitstream"])
-        else:
-            raise ValueError('Wrong File Extension')
+        def abort():
+            self.SetXilinxConfByte((self.xp_cs1 | self.xp_rdwr | self.xp_prog,))
+            return False
+
+        bitstream = self._read_bitstream(filename)
+        digest = hashlib.sha1(bitstream).hexdigest()
+        if record or (self.xilinx_state_file is not None and os.path.exists(self.xilinx_state_file)):
+            self._set_loaded_xilinx(None)  # a recorded hash is no longer valid
 
         self.InitXilinxConfPort()
 
         conf_reg = 0
-        time.sleep(0.5)
+        delay(0.5)
         # /* enable write */
         conf_reg |= self.xp_cs1  # // cs_b = 1
         conf_reg &= ~self.xp_rdwr  # // write_b = 0
         conf_reg |= self.xp_prog  # // prog_b = 1
         self.SetXilinxConfByte((conf_reg,))
-        time.sleep(0.5)
+        delay(0.5)
         # /* prog_b = 0 assert for at least 500ns */
         conf_reg |= self.xp_cs1  # // cs_b = 1
         conf_reg &= ~self.xp_rdwr  # // write_b = 0
         conf_reg &= ~self.xp_prog  # // prog_b = 0
         self.SetXilinxConfByte((conf_reg,))
-        time.sleep(0.5)
+        delay(0.5)
+        if poll and not self.WaitXilinxConfPin(self.xp_done, False, timeout):
+            return abort()
         # /* prog_b = 1 */
         conf_reg |= self.xp_cs1  # // cs_b = 1
         conf_reg &= ~self.xp_rdwr  # // write_b = 0
         conf_reg |= self.xp_prog  # // prog_b = 1
         self.SetXilinxConfByte((conf_reg,))
-        time.sleep(0.5)
+        time.sleep(prog_hold_time if poll else 0.5)  # clearing configuration memory
         # /* cs_b = 0 */
         conf_reg &= ~self.xp_cs1  # // cs_b = 0
         conf_reg &= ~self.xp_rdwr  # // write_b = 0
         conf_reg |= self.xp_prog  # // prog_b = 1
         self.SetXilinxConfByte((conf_reg,))
 
-        time.sleep(1.5)
+        delay(1.5)
+        if poll and not self.WaitXilinxConfPin(self.xp_busy, False, timeout):
+            return abort()
 
-        self._write(self.SUR_TYPE_XILINX, 0, bitstream[0:])
+        self._write(self.SUR_TYPE_XILINX, 0, bitstream)
 
-        time.sleep(1.5)
+        delay(1.5)
 
         self._write(self.SUR_TYPE_XILINX, 0, (0, 0, 0, 0, 0, 0, 0, 0))  # eight extra clock to enable start-up
 
-        time.sleep(1.0)
+        delay(1.0)
+        if poll and not self.WaitXilinxConfPin(self.xp_done, True, timeout):
+            return abort()
 
         # /* cs_b = 1 */
         conf_reg |= self.xp_cs1  # // cs_b = 1
         conf_reg &= ~self.xp_rdwr  # // write_b = 0
         conf_reg |= self.xp_prog  # // prog_b = 1
         self.SetXilinxConfByte((conf_reg,))
-        time.sleep(0.5)
+        delay(0.5)
         # // write_b = 1 (default condition)
         conf_reg |= self.xp_cs1  # // cs_b = 1
         conf_reg |= self.xp_rdwr  # // write_b = 1
         conf_reg |= self.xp_prog  # // prog_b = 1
         self.SetXilinxConfByte((conf_reg,))
-        time.sleep(0.5)
-        return self.GetXilinxConfPin(self.xp_done)
+        delay(0.5)
+        done = self.GetXilinxConfPin(self.xp_done)
+        if done and record:
+            self._set_loaded_xilinx(digest)
+        return done
+
+    def EnsureXilinxLoaded(self, filename, **kwargs):
+        '''Configure FPGA unless the bitstream in filename is already loaded.
+
+        The hash of the last downloaded bitstream is stored on the host for each board ID
+        (see xilinx_state_file). The download is skipped if DONE is high and the hash matches.
+        Keyword arguments are passed to DownloadXilinx(). Returns True if the FPGA is configured.
+        '''
+        digest = hashlib.sha1(self._read_bitstream(filename)).hexdigest()
+        if self.XilinxAlreadyLoaded() and self._get_loaded_xilinx() == digest:
+            return True
+        kwargs['record'] = True
+        return self.DownloadXilinx(filename, **kwargs)
+
+    def _read_bitstream(self, filename):
+        extension = os.path.splitext(filename)[1]
+        if extension == '.bin':
+            with open(filename, "rb") as f:
+                return f.read()
+        elif extension == '.bit':
+            return self._get_bit_file(filename)["Bitstream"]
+        else:
+            raise ValueError('Wrong File Extension')
+
+    def _read_xilinx_state(self):
+        try:
+            with open(self.xilinx_state_file, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _lock_xilinx_state(self):
+        # lock file against other processes, returns None if locking is not possible
+        if fcntl is None:
+            return None
+        lock_file = open(self.xilinx_state_file + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except (IOError, OSError):
+            lock_file.close()
+            raise
+        return lock_file
+
+    def _get_loaded_xilinx(self):
+        if self.xilinx_state_file is None:
+            return None
+        with _xilinx_state_lock:
+            return self._read_xilinx_state().get(self.board_id)
+
+    def _set_loaded_xilinx(self, digest):
+        if self.xilinx_state_file is None:
+            return
+        with _xilinx_state_lock:
+            lock_file = None
+            tmp_file = self.xilinx_state_file + '.%d.tmp' % os.getpid()
+            try:
+                board_id = self.board_id
+                lock_file = self._lock_xilinx_state()
+                state = self._read_xilinx_state()
+                if digest is None:
+                    if state.pop(board_id, None) is None:
+                        return
+                else:
+                    state[board_id] = digest
+                with open(tmp_file, "w") as f:
+                    json.dump(state, f, indent=2, sort_keys=True)
+                os.replace(tmp_file, self.xilinx_state_file)
+            except (IOError, OSError) as e:  # includes USB errors reading the board ID
+                logger.warning('Cannot update %s: %s', self.xilinx_state_file, e)
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
 
     def SetXilinxConfByte(self, reg):
         self._Write8051(self.IOA_FX, reg)
@@ -508,6 +1390,18 @@ class SiUSBDevice(object):
         reg = self.GetXilinxConfByte()
         return bool(reg & pin)
 
+    def WaitXilinxConfPin(self, pin, value, timeout, interval=0.001):
+        '''Poll Xilinx configuration pin until it has the given value.
+
+        Returns False if the pin did not change within timeout seconds.
+        '''
+        deadline = time.time() + timeout
+        while self.GetXilinxConfPin(pin) != bool(value):
+            if time.time() > deadline:
+                return False
+            time.sleep(interval)
+        return True
+
     def XilinxAlreadyLoaded(self):
         self.InitXilinxConfPort()
         return self.GetXilinxConfPin(self.xp_done)
@@ -526,7 +1420,8 @@ class SiUSBDevice(object):
         object normally. If the resources will be necessary again, it
         will allocate them automatically.
         '''
-        usb.util.dispose_resources(self.dev)
+        if isinstance(self.dev, usb.core.Device):
+            usb.util.dispose_resources(self.dev)
         self.dev = None
 
     def __del__(self):
@@ -535,6 +1430,83 @@ class SiUSBDevice(object):
                 self.dev.reset()
 
 
+class SiUSBBatch(object):
+    '''Batch of external bus accesses, see SiUSBDevice.batch().
+    '''
+
+    def __init__(self, device, stype=None):
+        self.device = device
+        self.stype = device.SUR_TYPE_EXTERNAL if stype is None else stype
+        self._address = None
+        self._data = bytearray()
+        self.transactions = 0
+
+    def __enter__(self):
+        self.device.lock.acquire()
+        self.device._batch_thread = get_ident()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._address = None
+            self._data = bytearray()
+            self.device._batch_thread = None
+            self.device.lock.release()
+
+    def write(self, address, data):
+        if not isinstance(data, (list, tuple)):
+            data = _WriteBuffer.from_data(data).tobytes()  # str and typed buffers as bytes
+        max_size = self.stype.ep_write.maxTransferSize
+        if self._address is not None and (address != self._address + len(self._data) or len(self._data) + len(data) > max_size):
+            self.flush()
+        if self._address is None:
+            self._address = address
+        self._data.extend(data)
+
+    def read(self, address, size):
+        self.flush()
+        cache = self.device.register_cache if self.stype is self.device.SUR_TYPE_EXTERNAL else None
+        if cache is not None:
+            cached = cache.get(address, size)
+            if cached is not None:
+                ret = array.array('B')
+                ret.frombytes(cached)
+                return ret
+        ret = array.array('B', [0]) * size
+        read = self.device._read_transfers(self.stype, address, memoryview(ret))
+        del ret[read:]
+        self.transactions += 1
+        if cache is not None and read == size:
+            cache.update(address, ret)
+        return ret
+
+    def flush(self):
+        '''Send pending writes.
+        '''
+        if self._address is None:
+            return
+        address, data = self._address, self._data
+        self._address = None
+        self._data = bytearray()
+        cache = self.device.register_cache if self.stype is self.device.SUR_TYPE_EXTERNAL else None
+        max_size = self.stype.ep_write.maxTransferSize
+        val = 0
+        try:
+            while val < len(data):
+                self.device._write_single(self.stype, address, data[val:val + max_size])
+                val += max_size
+                self.transactions += 1
+        except Exception:
+            if cache is not None:
+                cache.invalidate(address, len(data))
+            raise
+        if cache is not None:
+            self.device._update_register_cache(address, data)
+
+
 def GetUSBBoards():
     devs = usb.core.find(find_all=True, idVendor=0x5312, idProduct=0x0200)
     if devs is not None:  # iterator in Python 3
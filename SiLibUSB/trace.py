@@ -0,0 +1,335 @@
+r"""Transaction tracing and replay for SILAB USB devices.
+
+TransferTracer records every SUR transaction of a SiUSBDevice (see
+SiUSBDevice.enable_tracing()) to a binary trace file: SUR type, direction, address,
+size, bytes transferred, start time, duration, error flags and a digest of the payload.
+Write payloads can be stored as well, which allows replaying the writes with the
+original data. Records are written through a buffered file, the overhead per
+transaction is one struct pack and a digest of at most digest_limit bytes.
+
+A trace can be replayed against a device or an EmulatedDevice and the timing of each
+transaction is compared to the trace. Writes are only replayed with their stored
+payload (zeros with --emulate or --zero-writes), EEPROM writes only with --eeprom-writes:
+    python -m SiLibUSB.trace show session.trace
+    python -m SiLibUSB.trace replay session.trace [--emulate] [--realtime] [--verify]
+"""
+
+import argparse
+import array
+import ctypes
+import hashlib
+import json
+import struct
+import sys
+import time
+from collections import namedtuple
+from threading import Lock
+
+import usb.core
+
+from .siusbdevice import SiUSBDevice, __version__, _WriteBuffer, _byte_view
+from .instrumentation import _is_timeout
+
+
+TRACE_MAGIC = b'SILBTRC1'
+# type ID, direction, flags, address, size, transferred, start (s), duration (s), payload digest
+RECORD = struct.Struct('<BBBIIIdf8s')
+DIGEST_SIZE = 8
+
+FLAG_ERROR = 0x01
+FLAG_TIMEOUT = 0x02
+FLAG_PAYLOAD = 0x04
+
+TraceRecord = namedtuple('TraceRecord', ['type', 'direction', 'flags', 'address', 'size', 'transferred', 'start', 'duration', 'digest', 'payload'])
+ReplayResult = namedtuple('ReplayResult', ['record', 'duration', 'error', 'digest_match', 'skipped'])
+
+
+def _digest(view, limit):
+    if limit is not None:
+        view = view[:limit]
+    return hashlib.blake2b(view, digest_size=DIGEST_SIZE).digest()
+
+
+def _payload_view(data):
+    if isinstance(data, _WriteBuffer):
+        if not len(data):
+            return memoryview(b'')
+        return memoryview((ctypes.c_char * len(data)).from_address(data.address)).cast('B')
+    return _byte_view(data)
+
+
+class TransferTracer(object):
+    '''Write SUR transactions to a trace file.
+
+    digest_limit: number of payload bytes included in the digest (None for all)
+    payloads: store the payload of write transactions
+    '''
+
+    def __init__(self, filename, digest_limit=2 ** 16, payloads=False, metadata=None):
+        self.filename = filename
+        self.digest_limit = digest_limit
+        self.payloads = payloads
+        self.records = 0
+        self._lock = Lock()
+        self._start = time.perf_counter()
+        header = {'version': __version__, 'time': time.time(), 'digest_limit': digest_limit, 'payloads': payloads}
+        header.update(metadata or {})
+        header = json.dumps(header, sort_keys=True).encode('utf-8')
+        self._file = open(filename, 'wb', buffering=2 ** 16)
+        self._file.write(TRACE_MAGIC + struct.pack('<I', len(header)) + header)
+
+    def record(self, type_id, direction, address, size, transferred, start, duration, error, payload):
+        flags = 0
+        if error is not None:
+            flags |= FLAG_ERROR
+            if _is_timeout(error):
+                flags |= FLAG_TIMEOUT
+        store_payload = self.payloads and direction == SiUSBDevice.SUR_DIR_OUT
+        if store_payload:
+            flags |= FLAG_PAYLOAD
+        digest = _digest(payload, self.digest_limit)
+        with self._lock:
+            self._file.write(RECORD.pack(type_id, direction, flags, address, size, transferred, start - self._start, duration, digest))
+            if store_payload:
+                self._file.write(payload)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def trace(device, tracer):
+    '''Wrap the transaction methods of device recording into tracer.
+    '''
+    saved = dict((name, device.__dict__[name]) for name in ('_write_single', '_read_single_into') if name in device.__dict__)
+    write_single = device._write_single
+    read_single_into = device._read_single_into
+
+    def _write_single(stype, addr, data):
+        start = time.perf_counter()
+        error = None
+        try:
+            write_single(stype, addr, data)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            transferred = len(data) if error is None else getattr(error, 'transferred', 0)
+            tracer.record(stype.id, device.SUR_DIR_OUT, addr, len(data), transferred, start, time.perf_counter() - start, error, _payload_view(data))
+
+    def _read_single_into(stype, addr, view):
+        start = time.perf_counter()
+        error = None
+        read = 0
+        try:
+            read = read_single_into(stype, addr, view)
+        except Exception as e:
+            error = e
+            read = getattr(e, 'transferred', 0)
+            raise
+        finally:
+            tracer.record(stype.id, device.SUR_DIR_IN, addr, len(view), read, start, time.perf_counter() - start, error, view[:read])
+        return read
+
+    device._write_single = _write_single
+    device._read_single_into = _read_single_into
+    device._trace_saved = saved
+
+
+def untrace(device):
+    saved = device.__dict__.pop('_trace_saved', {})
+    for name in ('_write_single', '_read_single_into'):
+        if name in saved:
+            device.__dict__[name] = saved[name]
+        else:
+            device.__dict__.pop(name, None)
+
+
+def read_trace(filename):
+    '''Return the metadata dict and the list of TraceRecord of a trace file.
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+        raise ValueError('%s is not a trace file' % filename)
+    offset = len(TRACE_MAGIC)
+    size = struct.unpack_from('<I', data, offset)[0]
+    offset += 4
+    metadata = json.loads(data[offset:offset + size].decode('utf-8'))
+    offset += size
+    records = []
+    while offset + RECORD.size <= len(data):
+        fields = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        payload = None
+        if fields[2] & FLAG_PAYLOAD:
+            payload = data[offset:offset + fields[4]]
+            offset += fields[4]
+        records.append(TraceRecord(*(fields + (payload,))))
+    return metadata, records
+
+
+def _sur_types(device):
+    types = {}
+    for name in dir(device):
+        if name.startswith('SUR_TYPE_'):
+            stype = getattr(device, name)
+            types[stype.id] = stype
+    return types
+
+
+def replay(device, records, realtime=False, verify=False, digest_limit=2 ** 16, zero_writes=False, eeprom_writes=False):
+    '''Execute the transactions of records on device and return a list of ReplayResult.
+
+    Writes use the stored payload. Writes without stored payload (trace recorded with
+    payloads=False) are skipped unless zero_writes is True, which writes zeros instead;
+    only use this with an emulated device, writing zeros to the 8051 ports or the
+    Xilinx configuration interface disturbs the board. EEPROM writes (board name and
+    ID) are skipped unless eeprom_writes is True. Transactions of unknown SUR types are
+    skipped. With realtime=True the transactions start at the same relative times as
+    in the trace, otherwise back-to-back. With verify=True the digest of the read data
+    is compared to the trace (digest_match), digest_limit must be the one of the trace.
+    Errors are recorded in the results and do not stop the replay.
+    '''
+    types = _sur_types(device)
+    results = []
+    replay_start = time.perf_counter()
+    for record in records:
+        stype = types.get(record.type)
+        if record.direction == device.SUR_DIR_OUT:
+            skip = stype is None or (record.payload is None and not zero_writes) or (stype is device.SUR_TYPE_EEPROM and not eeprom_writes)
+            if not skip:
+                data = array.array('B', record.payload if record.payload is not None else bytes(record.size))
+        else:
+            skip = stype is None
+            buf = bytearray(record.size)
+            view = memoryview(buf)
+        if skip:
+            results.append(ReplayResult(record, 0.0, None, None, True))
+            continue
+        if realtime:
+            delay = replay_start + record.start - time.perf_counter()
+            if delay > 0.0:
+                time.sleep(delay)
+        error = None
+        digest_match = None
+        read = 0
+        start = time.perf_counter()
+        try:
+            with device.lock:
+                if record.direction == device.SUR_DIR_OUT:
+                    device._write_single(stype, record.address, data)
+                else:
+                    read = device._read_single_into(stype, record.address, view)
+        except usb.core.USBError as e:
+            error = e
+        duration = time.perf_counter() - start
+        if verify and record.direction == device.SUR_DIR_IN and error is None:
+            digest_match = _digest(view[:read], digest_limit) == record.digest
+        results.append(ReplayResult(record, duration, error, digest_match, False))
+    return results
+
+
+def summarize(results, types=None):
+    '''Return replay statistics per SUR type and direction.
+
+    Keyed by "type/direction", each entry holds the number of transactions, bytes,
+    the total trace and replay time, the ratio of the median durations, errors,
+    digest mismatches and skipped transactions. Skipped transactions are not included
+    in the timing.
+    '''
+    from .bench import percentiles
+    groups = {}
+    for result in results:
+        record = result.record
+        name = types[record.type].name if types is not None and record.type in types else str(record.type)
+        key = '%s/%s' % (name, 'out' if record.direction == SiUSBDevice.SUR_DIR_OUT else 'in')
+        groups.setdefault(key, []).append(result)
+    summary = {}
+    for key, group in groups.items():
+        replayed = [result for result in group if not result.skipped]
+        if replayed:
+            trace_p50 = percentiles([result.record.duration for result in replayed])['p50']
+            replay_p50 = percentiles([result.duration for result in replayed])['p50']
+        else:
+            trace_p50 = replay_p50 = 0.0
+        summary[key] = {
+            'transactions': len(replayed),
+            'bytes': sum(result.record.size for result in replayed),
+            'trace_time': sum(result.record.duration for result in replayed),
+            'replay_time': sum(result.duration for result in replayed),
+            'trace_p50': trace_p50,
+            'replay_p50': replay_p50,
+            'ratio': replay_p50 / trace_p50 if trace_p50 > 0.0 else (1.0 if replay_p50 == 0.0 else float('inf')),
+            'errors': sum(1 for result in replayed if result.error is not None),
+            'mismatches': sum(1 for result in replayed if result.digest_match is False),
+            'skipped': len(group) - len(replayed)
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m SiLibUSB.trace', description='Show and replay transaction traces of SILAB USB devices')
+    subparsers = parser.add_subparsers(dest='command')
+    show_parser = subparsers.add_parser('show', help='print the transactions of a trace')
+    show_parser.add_argument('trace')
+    replay_parser = subparsers.add_parser('replay', help='replay a trace and compare the timing')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--emulate', action='store_true', help='replay against an emulated device instead of hardware')
+    replay_parser.add_argument('--bandwidth', type=float, default=None, help='emulated link bandwidth in bytes/s')
+    replay_parser.add_argument('--latency', type=float, default=0.0, help='emulated latency per transfer in s')
+    replay_parser.add_argument('--board-id', default=None, help='board ID of the device, by default the first device is used')
+    replay_parser.add_argument('--realtime', action='store_true', help='keep the time between transactions of the trace')
+    replay_parser.add_argument('--verify', action='store_true', help='compare the digests of the read data')
+    replay_parser.add_argument('--zero-writes', action='store_true', help='replay writes without stored payload as zeros (implied by --emulate), may disturb real hardware')
+    replay_parser.add_argument('--eeprom-writes', action='store_true', help='also replay EEPROM writes (board name and ID)')
+    replay_parser.add_argument('--threshold', type=float, default=None, help='exit with 1 if the median duration of a group is slower than the trace by more than this fraction')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    metadata, records = read_trace(args.trace)
+    types = _sur_types(SiUSBDevice)
+    if args.command == 'show':
+        print(json.dumps(metadata, sort_keys=True))
+        for record in records:
+            name = types[record.type].name if record.type in types else str(record.type)
+            flags = ('E' if record.flags & FLAG_ERROR else '-') + ('T' if record.flags & FLAG_TIMEOUT else '-') + ('P' if record.flags & FLAG_PAYLOAD else '-')
+            print('%12.6f %-9s %-3s 0x%08x %9d %9d %10.3f ms %s %s' % (
+                record.start, name, 'out' if record.direction == SiUSBDevice.SUR_DIR_OUT else 'in',
+                record.address, record.size, record.transferred, record.duration * 1e3, flags, record.digest.hex()))
+        return 0
+
+    if args.emulate:
+        from .emulator import EmulatedDevice
+        dev = SiUSBDevice(device=EmulatedDevice(bandwidth=args.bandwidth, latency=args.latency))
+    elif args.board_id is not None:
+        dev = SiUSBDevice.from_board_id(args.board_id)
+    else:
+        dev = SiUSBDevice()
+    try:
+        results = replay(dev, records, realtime=args.realtime, verify=args.verify, digest_limit=metadata.get('digest_limit'),
+                         zero_writes=args.zero_writes or args.emulate, eeprom_writes=args.eeprom_writes)
+    finally:
+        dev.dispose()
+
+    summary = summarize(results, types)
+    slower = []
+    for key, entry in sorted(summary.items()):
+        print('%-16s %7d transactions %12d bytes  p50 trace %9.3f ms  replay %9.3f ms  x%6.2f  errors %d  mismatches %d  skipped %d' % (
+            key, entry['transactions'], entry['bytes'], entry['trace_p50'] * 1e3, entry['replay_p50'] * 1e3, entry['ratio'], entry['errors'], entry['mismatches'], entry['skipped']))
+        if args.threshold is not None and entry['ratio'] > 1.0 + args.threshold:
+            slower.append(key)
+    total_replay = sum(result.duration for result in results)
+    total_trace = sum(result.record.duration for result in results if not result.skipped)
+    print('total: trace %.3f ms, replay %.3f ms' % (total_trace * 1e3, total_replay * 1e3))
+    for key in slower:
+        print('SLOWER %s: x%.2f' % (key, summary[key]['ratio']))
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
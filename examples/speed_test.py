@@ -1,47 +1,7 @@
-import timeit
+# Fast block read/write throughput, see "python -m SiLibUSB.bench --help" for all benchmarks
+import sys
 
-import cProfile
+from SiLibUSB.bench import main
 
 
-s = """
-from SiLibUSB import SiUSBDevice
-
-sidev = SiUSBDevice()
-
-def FastBlockRead(bytes):
-    sidev.FastBlockRead(bytes)
-
-def FastBlockWrite(bytes):
-    sidev.FastBlockWrite('\\x00'*bytes)
-"""
-
-
-for i in range(1, 64):
-    size = i * (2**10)
-    repeat = 5
-    read = timeit.timeit(stmt="FastBlockRead( " + str(size) + " )", setup=s, number=repeat)
-    write = timeit.timeit(stmt="FastBlockWrite( " + str(size) + " )", setup=s, number=repeat)
-    print("size: {}kB; read : {}MB/s; write : {}MB/s".format(float(size) / 1024.0, float(size * repeat) / (1024.0 * 1024.0) / read, float(size * repeat) / (1024.0 * 1024.0) / write))
-
-
-"""
-import pstats
-from SiLibUSB import SiUSBDevice
-
-sidev = SiUSBDevice()
-
-
-def prof():
-    for i in range(1, 128):
-        sidev.ReadExternal(0x0000, 1024 * 32)
-        # sidev.FastBlockWrite( range(0, 1)*1024*32 )
-
-
-# cProfile.run('prof()')
-cProfile.run('prof()', '/tmp/fooprof')
-
-p = pstats.Stats('/tmp/fooprof')
-p.sort_stats('time').print_stats(20)
-
-p.sort_stats('cumulative').print_stats(10)
-"""
+sys.exit(main(['--only', 'block', '--sizes'] + [str(i * 2 ** 10) for i in range(1, 64)] + ['--repeat', '5']))
@@ -25,6 +25,6 @@ setup(
     maintainer=author,
     author_email=author_email,
     maintainer_email=author_email,
-    python_requires='>=2.7',
+    python_requires='>=3.8',
     platforms='any'
 )
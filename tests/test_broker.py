@@ -0,0 +1,90 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from multiprocessing import shared_memory
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+from SiLibUSB.broker import DeviceBroker, SiUSBDeviceProxy
+
+
+class TestBroker(unittest.TestCase):
+    def setUp(self):
+        self.counter = 0
+        self.counter_lock = threading.Lock()
+
+        def source(size):
+            with self.counter_lock:
+                self.counter += 1
+                return bytes([self.counter & 0xff]) * size
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'broker.sock')
+        self.devices = [SiUSBDevice(device=EmulatedDevice(board_id=str(i), address=i + 1, fast_block_source=source)) for i in range(2)]
+        self.broker = DeviceBroker(self.devices, self.socket_path)
+        self.broker.start()
+        deadline = time.time() + 5.0
+        while not os.path.exists(self.socket_path) and time.time() < deadline:
+            time.sleep(0.001)
+        self.proxy = SiUSBDeviceProxy(board_id=1, socket_path=self.socket_path, shm_size=4096)
+
+    def tearDown(self):
+        self.proxy.dispose()
+        self.broker.shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_socket(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+        self.assertEqual(SiUSBDeviceProxy.list_boards(self.socket_path), [device.board_id for device in self.devices])
+        self.assertRaises(RuntimeError, DeviceBroker([], self.socket_path).serve_forever)
+
+    def test_register_round_trip(self):
+        self.assertEqual(self.proxy.board_id, self.devices[1].board_id)
+        self.proxy.WriteExternal(0x10, [1, 2, 3])
+        self.assertEqual(bytes(self.devices[1].dev.external[0x10:0x13]), b'\x01\x02\x03')
+        self.assertEqual(list(self.proxy.ReadExternal(0x10, 3)), [1, 2, 3])
+        self.assertEqual(bytes(self.devices[0].dev.external[0x10:0x13]), bytes(3))
+        self.assertRaises(AttributeError, self.proxy._request, 'reset')
+
+    def test_fast_block(self):
+        self.assertEqual(bytes(self.proxy.FastBlockRead(100)), b'\x01' * 100)
+        buf = bytearray(6000)  # larger than the shared memory
+        self.assertEqual(self.proxy.FastBlockReadInto(buf), len(buf))
+        self.assertEqual(buf, b'\x02' * 3996 + b'\x03' * 2004)  # wraps at the end of the shared memory
+        self.proxy.FastBlockWrite(bytes(5000))
+        self.assertEqual(self.devices[1].dev.fast_block_written, 5000)
+
+    def test_concurrent_transfers(self):
+        results = []
+
+        def read():
+            for _ in range(20):
+                buf = bytearray(1024)
+                self.proxy.FastBlockReadInto(buf)
+                results.append(buf)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 80)
+        for buf in results:
+            # one transaction each, the data of other threads is never copied in
+            self.assertEqual(buf, buf[:1] * len(buf))
+
+    def test_dispose_with_view(self):
+        view = self.proxy.FastBlockReadView(100)
+        self.assertEqual(bytes(view), b'\x01' * 100)
+        name = self.proxy._shm.name
+        self.proxy.dispose()
+        self.assertRaises(ValueError, bytes, view)  # released
+        self.assertRaises(FileNotFoundError, shared_memory.SharedMemory, name=name)
+        self.proxy.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import array
+import struct
+import unittest
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestDtype(unittest.TestCase):
+    def setUp(self):
+        self.data = struct.pack('>4I', 1, 2, 0x01020304, 0xffffffff)
+        self.dev = SiUSBDevice(device=EmulatedDevice(fast_block_source=lambda size: self.data[:size]))
+        self.dev.dev.external[:len(self.data)] = self.data
+
+    @unittest.skipIf(np is not None, 'arrays are only returned without NumPy')
+    def test_array(self):
+        typecode = 'I' if array.array('I').itemsize == 4 else 'L'
+        ret = self.dev.FastBlockRead(16, dtype=typecode, byteorder='big')
+        self.assertIsInstance(ret, array.array)
+        self.assertEqual(ret.tolist(), [1, 2, 0x01020304, 0xffffffff])
+        self.assertEqual(self.dev.ReadExternal(0, 8, dtype=typecode, byteorder='>').tolist(), [1, 2])
+        self.assertEqual(self.dev.ReadExternal(0, 4, dtype='B').tolist(), [0, 0, 0, 1])
+        self.assertEqual(array.array('H', self.dev.ReadExternal(8, 4, dtype='H', byteorder='little')).tobytes(), b'\x01\x02\x03\x04')
+        self.assertRaises(ValueError, self.dev.FastBlockRead, 6, dtype=typecode)
+
+    @unittest.skipIf(np is None, 'NumPy not installed')
+    def test_numpy(self):
+        ret = self.dev.FastBlockRead(16, dtype='>u4')
+        self.assertIsInstance(ret, np.ndarray)
+        self.assertEqual(ret.tolist(), [1, 2, 0x01020304, 0xffffffff])
+        self.assertEqual(self.dev.FastBlockRead(16, dtype='u4', byteorder='big').tolist(), [1, 2, 0x01020304, 0xffffffff])
+        self.assertEqual(self.dev.ReadExternal(0, 8, dtype='>u4').tolist(), [1, 2])
+        self.assertEqual(self.dev.ReadExternal(8, 4, dtype='<u2').tolist(), [0x0201, 0x0403])
+        self.assertRaises(ValueError, self.dev.FastBlockRead, 6, dtype='u4')
+
+    def test_short_read(self):
+        self.data = self.data[:10]  # only two and a half items available
+        ret = self.dev.FastBlockRead(16, dtype='>u4' if np is not None else 'I', byteorder='big')
+        self.assertEqual(list(ret), [1, 2])
+
+    def test_write(self):
+        written = []
+        write_single = self.dev._write_single
+
+        def _write_single(stype, addr, data):
+            written.append(bytes(data))
+            write_single(stype, addr, data)
+
+        self.dev._write_single = _write_single
+        self.dev.FastBlockWrite([1, 0x01020304], dtype='I' if np is None else 'u4', byteorder='big')
+        self.dev.FastBlockWrite([1, 2], dtype='H', byteorder='little')
+        self.assertEqual(written, [struct.pack('>2I', 1, 0x01020304), struct.pack('<2H', 1, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
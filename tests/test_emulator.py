@@ -0,0 +1,33 @@
+import unittest
+
+import usb.core
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+
+
+class TestEmulatedDevice(unittest.TestCase):
+    def test_identity(self):
+        dev = SiUSBDevice(device=EmulatedDevice(board_id='0', board_name='Test', fw_version='12'))
+        self.assertEqual(dev.GetBoardId(), '0')
+        self.assertEqual(dev.GetName(), 'Test')
+        self.assertEqual(dev.GetFWVersion(), '12')
+        self.assertEqual(repr(dev), '0')
+        self.assertEqual(SiUSBDevice(device=EmulatedDevice(board_id='123')).GetBoardId(), '123')
+        self.assertEqual(SiUSBDevice(device=EmulatedDevice(board_id='12345')).GetBoardId(), '123')
+
+    def test_memory(self):
+        dev = SiUSBDevice(device=EmulatedDevice())
+        dev.WriteExternal(0xfffe, [1, 2, 3])  # end of the address space
+        self.assertEqual(bytes(dev.dev.external[0xfffe:]), b'\x01\x02')
+        self.assertEqual(list(dev.ReadExternal(0xfffe, 3)), [1, 2, 0])
+        dev.WriteI2C(0x40, [5, 6])
+        self.assertEqual(list(dev.ReadI2C(0x40, 3)), [5, 6, 0])
+
+    def test_no_transaction(self):
+        emulated = EmulatedDevice()
+        self.assertRaises(usb.core.USBError, emulated.read, SiUSBDevice.SUR_DATA_IN_PIPE, 1)
+        self.assertRaises(usb.core.USBError, emulated.write, SiUSBDevice.SUR_DATA_FASTOUT_PIPE, b'\x00')
+
+
+if __name__ == '__main__':
+    unittest.main()
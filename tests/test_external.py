@@ -0,0 +1,87 @@
+import unittest
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+
+
+class TestReadExternalMulti(unittest.TestCase):
+    def setUp(self):
+        self.dev = SiUSBDevice(device=EmulatedDevice())
+        self.dev.dev.external[:0x400] = bytearray(i & 0xff for i in range(0x400))
+        self.transactions = []
+        read_single_into = self.dev._read_single_into
+
+        def _read_single_into(stype, addr, view):
+            self.transactions.append((addr, len(view)))
+            return read_single_into(stype, addr, view)
+
+        self.dev._read_single_into = _read_single_into
+
+    def test_merge_ranges(self):
+        ranges = [(0x10, 2), (0x14, 4), (0x100, 1), (0x20, 1)]
+        views = self.dev.ReadExternalMulti(ranges, max_gap=16)
+        self.assertEqual([bytes(view) for view in views], [bytes(self.dev.dev.external[address:address + size]) for address, size in ranges])
+        # 0x10-0x20 merged into one transaction, 0x100 separate
+        self.assertEqual(self.transactions, [(0x10, 0x11), (0x100, 1)])
+
+    def test_no_merge(self):
+        views = self.dev.ReadExternalMulti([(0x14, 4), (0x10, 2)], max_gap=0)
+        self.assertEqual(bytes(views[0]), bytes(range(0x14, 0x18)))
+        self.assertEqual(bytes(views[1]), bytes(range(0x10, 0x12)))
+        self.assertEqual(self.transactions, [(0x10, 2), (0x14, 4)])
+
+    def test_overlapping_ranges(self):
+        views = self.dev.ReadExternalMulti([(0x10, 8), (0x12, 2), (0x16, 4)])
+        self.assertEqual([bytes(view) for view in views], [bytes(range(0x10, 0x18)), bytes(range(0x12, 0x14)), bytes(range(0x16, 0x1a))])
+        self.assertEqual(self.transactions, [(0x10, 10)])
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.dev = SiUSBDevice(device=EmulatedDevice())
+        self.writes = []
+        write_single = self.dev._write_single
+
+        def _write_single(stype, addr, data):
+            self.writes.append((addr, bytes(data)))
+            write_single(stype, addr, data)
+
+        self.dev._write_single = _write_single
+
+    def test_merge_consecutive_writes(self):
+        with self.dev.batch() as batch:
+            batch.write(0x10, [1])
+            batch.write(0x11, [2, 3])
+            batch.write(0x20, [4])
+        self.assertEqual(self.writes, [(0x10, b'\x01\x02\x03'), (0x20, b'\x04')])
+        self.assertEqual(batch.transactions, 2)
+        self.assertEqual(bytes(self.dev.dev.external[0x10:0x13]), b'\x01\x02\x03')
+
+    def test_flush_before_read(self):
+        with self.dev.batch() as batch:
+            batch.write(0x10, [5])
+            self.assertEqual(list(batch.read(0x10, 1)), [5])
+            batch.write(0x11, [6])
+        self.assertEqual(self.writes, [(0x10, b'\x05'), (0x11, b'\x06')])
+
+    def test_max_transfer_size(self):
+        max_size = self.dev.SUR_TYPE_EXTERNAL.ep_write.maxTransferSize
+        with self.dev.batch() as batch:
+            batch.write(0, [0] * max_size)
+            batch.write(max_size, [1])
+        self.assertEqual([(addr, len(data)) for addr, data in self.writes], [(0, max_size), (max_size, 1)])
+
+    def test_discard_on_exception(self):
+        with self.assertRaises(KeyError):
+            with self.dev.batch() as batch:
+                batch.write(0x10, [1])
+                raise KeyError()
+        self.assertEqual(self.writes, [])
+        self.assertFalse(self.dev.lock.locked())
+
+    def test_direct_access_raises(self):
+        with self.dev.batch():
+            self.assertRaises(RuntimeError, self.dev.ReadExternal, 0, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
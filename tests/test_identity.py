@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice, siusbdevice
+
+
+class OpenCountingDevice(EmulatedDevice):
+    def __init__(self, *args, **kwargs):
+        super(OpenCountingDevice, self).__init__(*args, **kwargs)
+        self.opened = 0
+        self.eeprom_reads = 0
+
+    def set_configuration(self, configuration=None):
+        self.opened += 1
+
+    def _read_data(self, type_id, address, size):
+        if type_id == SiUSBDevice.SUR_TYPE_EEPROM.id:
+            self.eeprom_reads += 1
+        return super(OpenCountingDevice, self)._read_data(type_id, address, size)
+
+
+class TestIdentity(unittest.TestCase):
+    def setUp(self):
+        siusbdevice._board_id_index.clear()
+        self.devices = [OpenCountingDevice(board_id=str(100 + i), bus=1, address=i + 1) for i in range(3)]
+
+    def test_cached(self):
+        dev = SiUSBDevice(device=self.devices[0])
+        self.assertEqual(dev.board_id, '100')
+        self.assertEqual(dev.board_name, 'Emulated')
+        self.assertEqual(dev.fw_version, '01')
+        reads = self.devices[0].eeprom_reads
+        self.assertEqual((dev.board_id, dev.board_name, repr(dev)), ('100', 'Emulated', '100'))
+        self.assertEqual(self.devices[0].eeprom_reads, reads)
+        dev.invalidate_identity()
+        self.assertEqual(dev.board_id, '100')
+        self.assertEqual(self.devices[0].eeprom_reads, reads + 1)
+
+    def test_from_board_id(self):
+        with mock.patch('usb.core.find', return_value=iter(self.devices)):
+            dev = SiUSBDevice.from_board_id(101)
+        self.assertIs(dev.dev, self.devices[1])
+        self.assertEqual([device.opened for device in self.devices], [1, 1, 1])
+        with mock.patch('usb.core.find', return_value=iter(self.devices)):
+            dev = SiUSBDevice.from_board_id(101)
+        self.assertIs(dev.dev, self.devices[1])
+        self.assertEqual([device.opened for device in self.devices], [1, 2, 1])  # only the known device
+
+    def test_from_board_id_moved(self):
+        with mock.patch('usb.core.find', return_value=iter(self.devices)):
+            SiUSBDevice.from_board_id(101)
+        # boards swapped between USB locations
+        self.devices[1].eeprom, self.devices[2].eeprom = self.devices[2].eeprom, self.devices[1].eeprom
+        with mock.patch('usb.core.find', return_value=iter(self.devices)):
+            dev = SiUSBDevice.from_board_id(101)
+        self.assertIs(dev.dev, self.devices[2])
+        with mock.patch('usb.core.find', return_value=iter(self.devices)):
+            self.assertRaises(ValueError, SiUSBDevice.from_board_id, 999)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import array
+import unittest
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+
+
+class TestReadInto(unittest.TestCase):
+    def setUp(self):
+        self.counter = 0
+
+        def source(size):
+            self.counter += 1
+            return bytes((self.counter + i) & 0xff for i in range(size))
+
+        self.dev = SiUSBDevice(device=EmulatedDevice(fast_block_source=source))
+        self.dev.dev.external[:0x100] = bytearray(range(0x100))
+
+    def test_fast_block_read_into(self):
+        buf = bytearray(100)
+        self.assertEqual(self.dev.FastBlockReadInto(buf), 100)
+        self.assertEqual(buf, bytearray((1 + i) & 0xff for i in range(100)))
+        buf = bytearray(20)
+        self.assertEqual(self.dev.FastBlockReadInto(memoryview(buf)[5:15]), 10)
+        self.assertEqual(buf, bytes(5) + bytes(range(2, 12)) + bytes(5))
+        buf = array.array('H', [0] * 4)
+        self.assertEqual(self.dev.FastBlockReadInto(buf), 8)
+        self.assertEqual(buf.tobytes(), bytes(range(3, 11)))
+
+    def test_fast_block_read(self):
+        ret = self.dev.FastBlockRead(10)
+        self.assertIsInstance(ret, array.array)
+        self.assertEqual(ret.tolist(), list(range(1, 11)))
+
+    def test_transfers(self):
+        buf = bytearray(1000)
+        self.assertEqual(self.dev.FastBlockReadInto(buf, transfer_size=300), 1000)
+        self.assertEqual(self.counter, 4)
+        self.assertEqual(buf[:300], bytearray((1 + i) & 0xff for i in range(300)))
+        self.assertEqual(buf[900:], bytearray((4 + i) & 0xff for i in range(100)))
+
+    def test_read_external_into(self):
+        buf = bytearray(8)
+        self.assertEqual(self.dev.ReadExternalInto(0x10, buf), 8)
+        self.assertEqual(buf, bytes(range(0x10, 0x18)))
+        self.assertEqual(self.dev.ReadExternal(0x20, 4).tolist(), list(range(0x20, 0x24)))
+
+    def test_readonly_buffer(self):
+        self.assertRaises(TypeError, self.dev.FastBlockReadInto, bytes(10))
+        self.assertRaises(TypeError, self.dev.FastBlockReadInto, memoryview(bytearray(10))[::2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import usb.core
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice, FastBlockReader, MultiBoardReader, FastBlockRecorder
+from SiLibUSB.readout import read_index
+
+
+class TestFastBlockReader(unittest.TestCase):
+    def setUp(self):
+        self.counter = 0
+
+        def source(size):
+            self.counter += 1
+            return bytes([self.counter & 0xff]) * size
+
+        self.dev = SiUSBDevice(device=EmulatedDevice(fast_block_source=source))
+
+    def test_overflow_accounting(self):
+        reader = FastBlockReader(self.dev, 4 * 1024, 1024, block=False)
+        reader.start()
+        deadline = time.time() + 5.0
+        while reader.overflows < 3 and time.time() < deadline:
+            time.sleep(0.001)
+        reader.stop()
+        self.assertGreaterEqual(reader.overflows, 3)
+        self.assertEqual(reader.fill_level, reader.buffer_size)
+        self.assertEqual(reader.read_bytes, reader.fill_level + reader.dropped_bytes)
+        # the oldest chunks are kept, newer chunks are dropped
+        self.assertEqual([reader.get()[0] for _ in range(reader.slots)], [1, 2, 3, 4])
+        self.assertEqual(reader.fill_level, 0)
+        self.assertRaises(queue.Empty, reader.get)
+
+    def test_blocking(self):
+        with FastBlockReader(self.dev, 4 * 1024, 1024, block=True) as reader:
+            chunks = [reader.get(timeout=1.0) for _ in range(10)]
+        self.assertEqual([chunk[0] for chunk in chunks], list(range(1, 11)))
+        self.assertEqual(reader.overflows, 0)
+        self.assertEqual(reader.dropped_bytes, 0)
+
+    def test_iter_views(self):
+        with FastBlockReader(self.dev, 4 * 1024, 1024, count=6) as reader:
+            chunks = [bytes(view) for view in reader.iter_views()]
+        self.assertEqual(chunks, [bytes([i]) * 1024 for i in range(1, 7)])
+        self.assertFalse(reader.running)
+
+
+class TestFastBlockReadStream(unittest.TestCase):
+    setUp = TestFastBlockReader.setUp
+
+    def test_count(self):
+        chunks = [bytes(view) for view in self.dev.FastBlockReadStream(256, depth=3, count=10)]
+        self.assertEqual(chunks, [bytes([i]) * 256 for i in range(1, 11)])
+        self.assertEqual(self.dev.FastBlockRead(1)[0], 11)  # nothing read beyond count
+
+    def test_close(self):
+        stream = self.dev.FastBlockReadStream(256, depth=2)
+        self.assertEqual(bytes(next(stream)), b'\x01' * 256)
+        stream.close()
+        read = self.counter
+        time.sleep(0.05)
+        self.assertEqual(self.counter, read)  # reader thread stopped
+
+    def test_depth(self):
+        self.assertRaises(ValueError, next, self.dev.FastBlockReadStream(256, depth=1))
+
+
+class TestMultiBoardReader(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.fail_after = {}
+        self.devices = [SiUSBDevice(device=EmulatedDevice(board_id=str(i), address=i + 1, fast_block_source=self._source(i))) for i in range(2)]
+
+    def _source(self, index):
+        def source(size):
+            with self.lock:
+                self.counters[index] = self.counters.get(index, 0) + 1
+                if self.counters[index] > self.fail_after.get(index, float('inf')):
+                    raise usb.core.USBError('Emulated failure')
+                return bytes([index]) * size
+        return source
+
+    def test_merged(self):
+        with MultiBoardReader(self.devices, 64, max_chunks=4) as reader:
+            chunks = [reader.get(timeout=1.0) for _ in range(20)]
+        self.assertEqual(set(chunk.board_id for chunk in chunks), set(reader.board_ids))
+        for chunk in chunks:
+            self.assertEqual(bytes(chunk.data), bytes([reader.board_ids.index(chunk.board_id)]) * 64)
+        timestamps = [chunk.timestamp for chunk in chunks]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_get_after_stop(self):
+        for merge in (True, False):
+            reader = MultiBoardReader(self.devices, 64, merge=merge, max_chunks=4)
+            reader.start()
+            reader.stop()
+            board_id = None if merge else reader.board_ids[0]
+            for _ in range(4 * len(self.devices)):  # drain
+                try:
+                    reader.get(board_id=board_id)
+                except queue.Empty:
+                    break
+            self.assertRaises(queue.Empty, reader.get, board_id=board_id)
+            self.assertRaises(queue.Empty, reader.get, timeout=10.0, board_id=board_id)
+
+    def test_error(self):
+        self.fail_after[1] = 3
+        reader = MultiBoardReader(self.devices, 64, merge=False, max_chunks=8)
+        reader.start()
+        board_id = reader.board_ids[1]
+        chunks = [reader.get(timeout=1.0, board_id=board_id) for _ in range(3)]
+        self.assertEqual([bytes(chunk.data) for chunk in chunks], [b'\x01' * 64] * 3)
+        self.assertRaises(usb.core.USBError, reader.get, timeout=1.0, board_id=board_id)
+        self.assertIn(board_id, reader.errors)
+        self.assertRaises(queue.Empty, reader.get, board_id=board_id)  # board readout ended
+        self.assertEqual(bytes(reader.get(timeout=1.0, board_id=reader.board_ids[0]).data), bytes(64))
+        reader.stop()
+
+
+class TestFastBlockRecorder(unittest.TestCase):
+    setUp = TestFastBlockReader.setUp
+
+    def record(self, chunks, **kwargs):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        recorder = FastBlockRecorder(self.dev, os.path.join(self.tmp_dir, 'run.dat'), chunk_size=1024, buffer_size=16 * 1024, **kwargs)
+        with recorder:
+            deadline = time.time() + 5.0
+            while recorder.written_bytes < chunks * 1024 and time.time() < deadline:
+                time.sleep(0.001)
+        return recorder
+
+    def check_file(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        index = read_index(filename)
+        self.assertEqual(sum(size for _, size, _ in index), len(data))
+        for offset, size, _ in index:
+            chunk = data[offset:offset + size]
+            self.assertEqual(chunk, chunk[:1] * size)
+        timestamps = [timestamp for _, _, timestamp in index]
+        self.assertEqual(timestamps, sorted(timestamps))
+        return [data[offset] for offset, _, _ in index]
+
+    def test_record(self):
+        recorder = self.record(8)
+        self.assertEqual(recorder.files, [os.path.join(self.tmp_dir, 'run.dat')])
+        values = self.check_file(recorder.files[0])
+        self.assertEqual(len(values) * 1024, recorder.written_bytes)
+        # chunks are in order, chunks read while the ring buffer was full are dropped
+        self.assertEqual(recorder.written_bytes + recorder.dropped_bytes, recorder.reader.read_bytes)
+        self.assertEqual(values[:16], list(range(1, min(len(values), 16) + 1)))  # no overflow before the ring buffer is full
+
+    def test_rotation(self):
+        recorder = self.record(8, max_file_size=2048)
+        self.assertEqual(recorder.files[:2], [os.path.join(self.tmp_dir, 'run_0000.dat'), os.path.join(self.tmp_dir, 'run_0001.dat')])
+        values = []
+        for filename in recorder.files:
+            self.assertLessEqual(os.path.getsize(filename), 2048)  # preallocated space truncated
+            values += self.check_file(filename)
+        self.assertEqual(len(values) * 1024, recorder.written_bytes)
+        self.assertEqual(values[:16], list(range(1, min(len(values), 16) + 1)))  # no overflow before the ring buffer is full
+
+    def test_max_file_size(self):
+        self.assertRaises(ValueError, FastBlockRecorder, self.dev, 'run.dat', chunk_size=1024, max_file_size=512)
+
+
+if __name__ == '__main__':
+    unittest.main()
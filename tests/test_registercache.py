@@ -0,0 +1,58 @@
+import array
+import unittest
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice, RegisterCache
+
+
+class TestRegisterCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = RegisterCache()
+        self.cache.add_cacheable(0x100, 0x10)
+        self.cache.add_volatile(0x108, 1)
+
+    def test_valid_bytes(self):
+        self.assertIsNone(self.cache.get(0x100, 2))
+        self.cache.update(0x100, [1])
+        self.assertIsNone(self.cache.get(0x100, 2))  # only first byte known
+        self.cache.update(0x101, [2])
+        self.assertEqual(self.cache.get(0x100, 2), b'\x01\x02')
+        self.assertEqual(self.cache.stats, {'hits': 1, 'misses': 2, 'bypassed': 0})
+
+    def test_volatile(self):
+        self.cache.update(0x100, bytes(16))
+        self.assertIsNone(self.cache.get(0x108, 1))
+        self.assertIsNone(self.cache.get(0x106, 4))  # range includes volatile register
+        self.assertEqual(self.cache.get(0x109, 2), b'\x00\x00')
+        self.assertEqual(self.cache.stats['bypassed'], 2)
+
+    def test_outside_and_partial_ranges(self):
+        self.cache.update(0xfe, bytes(range(4)))  # partially inside
+        self.assertEqual(self.cache.get(0x100, 2), b'\x02\x03')
+        self.assertIsNone(self.cache.get(0xfe, 2))
+        self.assertIsNone(self.cache.get(0x10f, 2))
+
+    def test_invalidate(self):
+        self.cache.update(0x100, bytes(16))
+        self.cache.invalidate(0x102, 2)
+        self.assertIsNone(self.cache.get(0x100, 4))
+        self.assertEqual(self.cache.get(0x104, 4), bytes(4))
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get(0x104, 4))
+
+    def test_overlapping_cacheable(self):
+        self.assertRaises(ValueError, self.cache.add_cacheable, 0x10f, 2)
+
+    def test_device(self):
+        dev = SiUSBDevice(device=EmulatedDevice())
+        dev.register_cache = self.cache
+        dev.WriteExternal(0x100, 'ab')
+        dev.dev.external[0x100] = 0  # changed behind the cache
+        self.assertEqual(dev.ReadExternal(0x100, 2).tobytes(), b'ab')
+        dev.WriteExternal(0x102, array.array('I', [0x01020304]))
+        self.assertEqual(self.cache.get(0x102, 4), array.array('I', [0x01020304]).tobytes())
+        dev.dev.external[0x108] = 7
+        self.assertEqual(list(dev.ReadExternal(0x108, 1)), [7])
+
+
+if __name__ == '__main__':
+    unittest.main()
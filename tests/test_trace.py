@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+from SiLibUSB.trace import read_trace, replay, FLAG_PAYLOAD, RECORD
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.trace')
+        os.close(fd)
+        self.dev = SiUSBDevice(device=EmulatedDevice())
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_round_trip(self):
+        tracer = self.dev.enable_tracing(self.filename, payloads=True)
+        self.dev.WriteExternal(0x10, [1, 2, 3])
+        self.assertEqual(list(self.dev.ReadExternal(0x10, 3)), [1, 2, 3])
+        self.dev.FastBlockRead(100)
+        self.dev.disable_tracing()
+        self.assertNotIn('_write_single', self.dev.__dict__)
+
+        metadata, records = read_trace(self.filename)
+        self.assertTrue(metadata['payloads'])
+        self.assertEqual(len(records), tracer.records)
+        write, read, block = records
+        ext = self.dev.SUR_TYPE_EXTERNAL.id
+        self.assertEqual((write.type, write.direction, write.address, write.size, write.transferred), (ext, self.dev.SUR_DIR_OUT, 0x10, 3, 3))
+        self.assertTrue(write.flags & FLAG_PAYLOAD)
+        self.assertEqual(write.payload, b'\x01\x02\x03')
+        self.assertEqual((read.type, read.direction, read.size, read.payload), (ext, self.dev.SUR_DIR_IN, 3, None))
+        self.assertEqual(read.digest, write.digest)  # same payload
+        self.assertEqual((block.type, block.size), (self.dev.SUR_TYPE_GPIFBLOCK.id, 100))
+        self.assertLessEqual(write.start, read.start)
+
+    def test_replay_skips_writes_without_payload(self):
+        self.dev.enable_tracing(self.filename)
+        self.dev.WriteExternal(0x10, [1])
+        self.dev.WriteEEPROM(0x100, [1])
+        self.dev.ReadExternal(0x10, 1)
+        self.dev.disable_tracing()
+        with open(self.filename, 'ab') as f:
+            f.write(RECORD.pack(99, 1, 0, 0, 4, 4, 0.0, 0.0, bytes(8)))  # unknown SUR type
+        _, records = read_trace(self.filename)
+        target = SiUSBDevice(device=EmulatedDevice())
+        results = replay(target, records, verify=True)
+        self.assertEqual([result.skipped for result in results], [True, True, False, True])
+        self.assertFalse(results[2].digest_match)  # the skipped write did not set the register
+        results = replay(target, records, verify=True, zero_writes=True)
+        self.assertEqual([result.skipped for result in results], [False, True, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+
+import usb.core
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+from SiLibUSB.emulator import USBTimeoutError
+from SiLibUSB.siusbdevice import TransferError, TransferTimeoutError
+
+
+class CountingDevice(EmulatedDevice):
+    def __init__(self, *args, **kwargs):
+        super(CountingDevice, self).__init__(*args, **kwargs)
+        self.calls = []
+
+    def write(self, endpoint, data, timeout=None):
+        self.calls.append(('write', endpoint, len(data)))
+        return super(CountingDevice, self).write(endpoint, data, timeout)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        ret = super(CountingDevice, self).read(endpoint, size_or_buffer, timeout)
+        self.calls.append(('read', endpoint, ret if isinstance(ret, int) else len(ret)))
+        return ret
+
+
+class TestBulkTransfers(unittest.TestCase):
+    def test_single_bulk_call(self):
+        dev = SiUSBDevice(device=CountingDevice())
+        dev.WriteExternal(0, bytes(200))
+        self.assertEqual(dev.ReadExternal(0, 200).tolist(), [0] * 200)
+        header = SiUSBDevice.SUR_HEADER.size
+        self.assertEqual(dev.dev.calls, [('write', 0x01, header), ('write', 0x01, 200), ('write', 0x01, header), ('read', 0x81, 200)])
+
+    def test_packetized(self):
+        dev = SiUSBDevice(device=CountingDevice(), packetized=True)
+        dev.WriteExternal(0, bytes(range(200)))
+        self.assertEqual(dev.ReadExternal(0, 200).tolist(), list(range(200)))
+        payload = [call[2] for call in dev.dev.calls[1:5]]
+        self.assertEqual(payload, [64, 64, 64, 8])
+        self.assertEqual([call[2] for call in dev.dev.calls if call[0] == 'read'], [64, 64, 64, 8])
+
+
+class FailingDevice(EmulatedDevice):
+    '''Emulated device timing out on the given calls (counted per endpoint) of read() and write().
+    '''
+    def __init__(self, fail_calls, *args, **kwargs):
+        super(FailingDevice, self).__init__(*args, **kwargs)
+        self.fail_calls = fail_calls
+        self.calls = {}
+
+    def _fail(self, endpoint):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if (endpoint, self.calls[endpoint]) in self.fail_calls:
+            raise USBTimeoutError('Operation timed out', None, 110)
+
+    def write(self, endpoint, data, timeout=None):
+        self._fail(endpoint)
+        return super(FailingDevice, self).write(endpoint, data, timeout)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        self._fail(endpoint)
+        return super(FailingDevice, self).read(endpoint, size_or_buffer, timeout)
+
+
+class TestTransferErrors(unittest.TestCase):
+    def test_timeout_scales_with_size(self):
+        dev = SiUSBDevice(device=EmulatedDevice())
+        self.assertEqual(dev._get_timeout(0), dev.timeout)
+        self.assertEqual(dev._get_timeout(2 ** 21), int(dev.timeout + dev.timeout_factor * 1000.0 * 2 ** 21 / dev.link_speed))
+        self.assertGreater(dev._get_timeout(2 ** 22), dev._get_timeout(2 ** 21))
+
+    def test_resume_read(self):
+        counter = [0]
+
+        def source(size):
+            counter[0] += 1
+            return bytes([counter[0]]) * size
+
+        dev = SiUSBDevice(device=FailingDevice([(0x86, 3)], fast_block_source=source))
+        buf = bytearray(300)
+        with self.assertRaises(TransferTimeoutError) as context:
+            dev.FastBlockReadInto(buf, transfer_size=100)
+        error = context.exception
+        self.assertIsInstance(error, USBTimeoutError)
+        self.assertEqual(error.errno, 110)
+        self.assertEqual(error.strerror, 'Operation timed out')
+        self.assertEqual(error.transferred, 200)
+        self.assertIs(error.buffer, buf)
+        self.assertEqual(bytes(error.data), b'\x01' * 100 + b'\x02' * 100)
+        self.assertEqual(dev.ResumeTransfer(error), 300)
+        self.assertEqual(buf, b'\x01' * 100 + b'\x02' * 100 + b'\x04' * 100)
+
+    def test_resume_write(self):
+        dev = SiUSBDevice(device=FailingDevice([(0x02, 2)]))
+        with self.assertRaises(TransferError) as context:
+            dev.FastBlockWrite(bytes(300), transfer_size=100)
+        error = context.exception
+        self.assertEqual(error.transferred, 100)
+        self.assertEqual(dev.dev.fast_block_written, 100)
+        dev.dev.reset()
+        self.assertEqual(dev.ResumeTransfer(error), 300)
+        self.assertEqual(dev.dev.fast_block_written, 300)
+
+    def test_resume_fails_again(self):
+        dev = SiUSBDevice(device=FailingDevice([(0x86, 2), (0x86, 3)]))
+        buf = bytearray(300)
+        with self.assertRaises(TransferError) as context:
+            dev.FastBlockReadInto(buf, transfer_size=100)
+        with self.assertRaises(TransferError) as context_resume:
+            dev.ResumeTransfer(context.exception)
+        self.assertEqual(context_resume.exception.transferred, 100)  # relative to the original transfer
+        self.assertIs(context_resume.exception.buffer, buf)
+        self.assertEqual(dev.ResumeTransfer(context_resume.exception), 300)
+
+
+class TestEndpointSettings(unittest.TestCase):
+    def test_per_device(self):
+        dev1 = SiUSBDevice(device=EmulatedDevice())
+        dev2 = SiUSBDevice(device=EmulatedDevice())
+        dev1.SUR_TYPE_GPIFBLOCK.ep_read.maxTransferSize = 1024
+        self.assertEqual(dev2.SUR_TYPE_GPIFBLOCK.ep_read.maxTransferSize, 2 ** 21)
+        self.assertEqual(SiUSBDevice.SUR_TYPE_GPIFBLOCK.ep_read.maxTransferSize, 2 ** 21)
+        # SUR types sharing an endpoint still share the copy
+        self.assertIs(dev1.SUR_TYPE_GPIFBLOCK.ep_read, dev1.SUR_EP6_RD)
+        self.assertIs(dev1.SUR_TYPE_EXTERNAL.ep_read, dev1.SUR_TYPE_EEPROM.ep_read)
+
+    def test_tune_transfer_size(self):
+        dev = SiUSBDevice(device=EmulatedDevice(latency=1e-3))
+        result = dev.TuneTransferSize(candidates=[2 ** 10, 2 ** 14], total_size=2 ** 14, repeat=1)
+        # fewer transfers are faster with a latency per transfer
+        self.assertEqual(result['read']['transfer_size'], 2 ** 14)
+        self.assertEqual(result['write']['transfer_size'], 2 ** 14)
+        self.assertEqual(dev.SUR_TYPE_GPIFBLOCK.ep_read.maxTransferSize, 2 ** 14)
+        self.assertEqual(dev.SUR_TYPE_GPIFBLOCK.ep_write.maxTransferSize, 2 ** 14)
+        self.assertEqual(SiUSBDevice.SUR_TYPE_GPIFBLOCK.ep_read.maxTransferSize, 2 ** 21)
+        self.assertRaises(ValueError, dev.TuneTransferSize, directions=('sideways',))
+
+
+if __name__ == '__main__':
+    unittest.main()
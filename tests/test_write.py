@@ -0,0 +1,60 @@
+import array
+import unittest
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestWriteBuffers(unittest.TestCase):
+    def setUp(self):
+        self.dev = SiUSBDevice(device=EmulatedDevice())
+
+    def assertWritten(self, data, expected):
+        self.dev.dev.external[:0x10] = bytes(0x10)
+        self.dev.WriteExternal(0, data)
+        self.assertEqual(bytes(self.dev.dev.external[:len(expected)]), expected)
+
+    def test_bytes(self):
+        self.assertWritten(b'\x01\x02\x03', b'\x01\x02\x03')
+        self.assertWritten(bytearray(b'\x04\x05'), b'\x04\x05')
+        self.assertWritten('ab', b'ab')
+
+    def test_sequences(self):
+        self.assertWritten([1, 2, 3], b'\x01\x02\x03')
+        self.assertWritten((4, 5), b'\x04\x05')
+        self.assertWritten(array.array('B', [6, 7]), b'\x06\x07')
+        self.assertWritten(array.array('H', [0x0102]), array.array('H', [0x0102]).tobytes())
+
+    def test_memoryview(self):
+        buf = bytearray(range(8))
+        self.assertWritten(memoryview(buf)[2:5], b'\x02\x03\x04')
+        self.assertWritten(memoryview(bytes(range(8)))[1:3], b'\x01\x02')
+        self.assertWritten(memoryview(buf)[::2], b'\x00\x02\x04\x06')  # strided
+        self.assertWritten(memoryview(buf)[::-3], b'\x07\x04\x01')
+        self.assertEqual(buf, bytearray(range(8)))
+
+    @unittest.skipIf(np is None, 'NumPy not installed')
+    def test_numpy(self):
+        self.assertWritten(np.arange(4, dtype='u1'), b'\x00\x01\x02\x03')
+        self.assertWritten(np.arange(8, dtype='u1')[::2], b'\x00\x02\x04\x06')
+        self.assertWritten(np.array([0x0102], dtype='>u2'), b'\x01\x02')
+        self.assertWritten(np.arange(4, dtype='<u2')[::2], b'\x00\x00\x02\x00')
+        self.assertWritten(np.arange(4, dtype='u1').reshape(2, 2).T, b'\x00\x02\x01\x03')
+
+    def test_empty(self):
+        self.dev.WriteExternal(0, b'')
+        self.dev.WriteExternal(0, [])
+
+    def test_fast_block_write_transfers(self):
+        data = bytearray(range(256)) * 40
+        self.dev.FastBlockWrite(memoryview(data)[::2], transfer_size=1000)
+        self.dev.FastBlockWrite(data, transfer_size=1000)
+        self.assertEqual(self.dev.dev.fast_block_written, len(data) // 2 + len(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
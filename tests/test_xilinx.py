@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import usb.core
+
+from SiLibUSB import SiUSBDevice, EmulatedDevice, siusbdevice
+from SiLibUSB.bench import write_bit_file
+
+
+def reverse_loop(bitstream):
+    # bit reversal of pySiLibUSB <= 3.0
+    bitstream = bytearray(bitstream)
+    for i, b in enumerate(bitstream):
+        bitstream[i] = (b * 0x0202020202 & 0x010884422010) % 1023
+    return bitstream
+
+
+class XilinxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.bit_file = os.path.join(self.tmp_dir, 'test.bit')
+        write_bit_file(self.bit_file, 4096)
+        siusbdevice._bit_file_cache.clear()
+        self.dev = SiUSBDevice(device=EmulatedDevice())
+        self.dev.xilinx_state_file = None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestBitFile(XilinxTestCase):
+    def test_bit_reversal(self):
+        with open(self.bit_file, 'rb') as f:
+            raw = f.read()[-4096:]
+        bit_file = self.dev._read_bit_file(self.bit_file)
+        self.assertEqual(bit_file['Bitstream'], reverse_loop(raw))
+        self.assertEqual(bytes(bytearray(range(256))).translate(siusbdevice._BIT_REVERSE_TABLE), bytes(reverse_loop(range(256))))
+        self.assertEqual(bit_file['Part Name'], b'bench\0')
+
+    def test_download(self):
+        self.assertTrue(self.dev.DownloadXilinx(self.bit_file, poll=True))
+        self.assertEqual(self.dev.dev.xilinx_data, self.dev._read_bit_file(self.bit_file)['Bitstream'])
+        self.assertTrue(self.dev.XilinxAlreadyLoaded())
+
+    def test_program_latency(self):
+        self.dev = SiUSBDevice(device=EmulatedDevice(program_latency=0.05))
+        self.dev.xilinx_state_file = None
+        self.assertFalse(self.dev.DownloadXilinx(self.bit_file, poll=True, prog_hold_time=0.0, timeout=0.1))
+        self.assertFalse(self.dev.XilinxAlreadyLoaded())
+        self.assertTrue(self.dev.DownloadXilinx(self.bit_file, poll=True, prog_hold_time=0.1, timeout=0.1))
+
+    def test_disk_cache(self):
+        self.dev.bitstream_cache_dir = self.tmp_dir
+        expected = self.dev._read_bit_file(self.bit_file)
+        self.assertEqual(len([name for name in os.listdir(self.tmp_dir) if name.endswith('.pickle')]), 1)
+        siusbdevice._bit_file_cache.clear()
+        self.assertEqual(self.dev._read_bit_file(self.bit_file), expected)
+
+    def test_disk_cache_not_writable(self):
+        self.dev.bitstream_cache_dir = os.path.join(self.tmp_dir, 'missing')
+        with self.assertLogs(siusbdevice.logger, 'WARNING'):
+            self.assertTrue(self.dev.DownloadXilinx(self.bit_file, poll=True))
+        self.assertFalse(os.path.exists(self.dev.bitstream_cache_dir))
+
+    def test_threads(self):
+        files = [self.bit_file]
+        for i in range(siusbdevice._BIT_FILE_CACHE_SIZE + 2):
+            files.append(os.path.join(self.tmp_dir, '%d.bit' % i))
+            write_bit_file(files[-1], 64)
+        errors = []
+
+        def parse():
+            try:
+                for _ in range(20):
+                    for filename in files:
+                        self.dev._get_bit_file(filename)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=parse) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(siusbdevice._bit_file_cache), siusbdevice._BIT_FILE_CACHE_SIZE)
+
+
+class TestEnsureXilinxLoaded(XilinxTestCase):
+    def setUp(self):
+        super(TestEnsureXilinxLoaded, self).setUp()
+        self.dev.xilinx_state_file = os.path.join(self.tmp_dir, 'xilinx.json')
+        self.downloads = 0
+        download = self.dev.DownloadXilinx
+
+        def DownloadXilinx(*args, **kwargs):
+            self.downloads += 1
+            return download(*args, **kwargs)
+
+        self.dev.DownloadXilinx = DownloadXilinx
+
+    def test_skip_download(self):
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertEqual(self.downloads, 1)
+        other = os.path.join(self.tmp_dir, 'other.bit')
+        write_bit_file(other, 4096)
+        self.assertTrue(self.dev.EnsureXilinxLoaded(other, poll=True))
+        self.assertEqual(self.downloads, 2)
+
+    def test_unconfigured(self):
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.dev.dev.xilinx_done = False
+        self.dev.dev._update_xilinx_conf()
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertEqual(self.downloads, 2)
+
+    def test_plain_download_clears_record(self):
+        self.assertTrue(self.dev.DownloadXilinx(self.bit_file, poll=True))
+        self.assertFalse(os.path.exists(self.dev.xilinx_state_file))  # not created by a plain download
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertTrue(self.dev.DownloadXilinx(self.bit_file, poll=True))
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertEqual(self.downloads, 4)
+
+    def test_disabled(self):
+        self.dev.xilinx_state_file = None
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+        self.assertEqual(self.downloads, 2)
+
+    def test_board_id_error(self):
+        self.assertTrue(self.dev.EnsureXilinxLoaded(self.bit_file, poll=True))
+
+        def GetBoardId():
+            raise usb.core.USBError('Emulated failure')
+
+        self.dev.invalidate_identity()
+        self.dev.GetBoardId = GetBoardId
+        with self.assertLogs(siusbdevice.logger, 'WARNING'):
+            self.assertTrue(self.dev.DownloadXilinx(self.bit_file, poll=True))
+
+
+if __name__ == '__main__':
+    unittest.main()